@@ -1,7 +1,12 @@
-# This will make sure the app is always imported when
-# Django starts so that shared_task will use this app.
-try:
-    from .celery import app as celery_app
-    __all__ = ('celery_app',)
-except ImportError:
-    pass
\ No newline at end of file
+# The Celery app is loaded lazily so web processes never import Celery.
+# Workers load it through `celery -A core`, which imports core.celery and
+# binds shared_task to this app; code that enqueues tasks from a web process
+# can import `core.celery_app` (or `core.celery.app`) explicitly.
+__all__ = ('celery_app',)
+
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,4 +3,6 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-abc123def456')
\ No newline at end of file
+SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-abc123def456')
+# path of a SQLite read replica, refreshed from the primary by a Celery task
+READ_REPLICA_DB = os.environ.get('READ_REPLICA_DB')
@@ -1,7 +1,8 @@
 import os
 from celery import Celery
+from .db_router import sync_sqlite_replicas
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.core.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 app = Celery('core')
 
@@ -12,4 +13,10 @@ app.autodiscover_tasks()
 
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}')
\ No newline at end of file
+    print(f'Request: {self.request!r}')
+
+
+@app.task
+def sync_read_replicas():
+    # no-op unless READ_REPLICA_DB is set
+    return sync_sqlite_replicas()
@@ -0,0 +1,66 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalListMixin:
+    """
+    Answers conditional GETs on list endpoints with 304 Not Modified.
+
+    The validator is a fingerprint of the filtered queryset (row count plus
+    max(updated_at)), computed in a single aggregate query before pagination
+    and serialization run. Query params are folded into the ETag so that each
+    page / ordering / filter combination gets its own validator.
+    """
+
+    fingerprint_field = 'updated_at'
+
+    def get_list_fingerprint(self, queryset):
+        return queryset.order_by().aggregate(
+            last_modified=Max(self.fingerprint_field),
+            count=Count('pk'),
+        )
+
+    def make_list_etag(self, request, fingerprint):
+        last_modified = fingerprint['last_modified']
+        raw = '|'.join([
+            request.get_full_path(),
+            str(fingerprint['count']),
+            last_modified.isoformat() if last_modified else '',
+        ])
+        return 'W/' + quote_etag(hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+    def is_not_modified(self, request, etag):
+        # If-Modified-Since is not honoured: a soft delete, or a row leaving
+        # the filtered set, changes the count but not max(updated_at), so a
+        # date alone can't tell that the list changed. Last-Modified is
+        # still sent as information.
+        if_none_match = request.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        # weak comparison, see RFC 9110 section 13.1.2
+        etags = parse_etags(if_none_match)
+        return '*' in etags or any(
+            tag.removeprefix('W/') == etag.removeprefix('W/') for tag in etags
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        fingerprint = self.get_list_fingerprint(queryset)
+        # lets the paginator skip its own COUNT(*) over the same queryset
+        self.list_row_count = fingerprint['count']
+        etag = self.make_list_etag(request, fingerprint)
+        last_modified = fingerprint['last_modified']
+
+        if self.is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().list(request, *args, **kwargs)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
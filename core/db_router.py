@@ -0,0 +1,92 @@
+import random
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# reads go to the primary unless the context opts into the replicas, so
+# tasks, commands and threads read their own writes without thinking about it
+_use_primary = ContextVar('use_primary', default=True)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_primary(pinned=True):
+    """Routes this request's / task's reads to the primary (or, with `pinned=False`, lets them use a replica), returns a token for unpin()."""
+    return _use_primary.set(pinned)
+
+
+def unpin(token):
+    _use_primary.reset(token)
+
+
+@contextmanager
+def use_primary():
+    token = pin_primary()
+    try:
+        yield
+    finally:
+        unpin(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a random alias of DATABASE_REPLICAS and everything else
+    to `default`. Replica reads are opt-in: only a context unpinned with
+    pin_primary(False) (safe requests, see ReplicaPinMiddleware) uses them,
+    and even then reads inside a transaction on the primary stay there, so a
+    write path always reads its own writes.
+    select_for_update() querysets are routed as writes by Django itself.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replica_aliases()
+        if not aliases or _use_primary.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema from the primary
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def sync_sqlite_database(source, target):
+    """Copies `source` into `target` with SQLite's online backup API, readers of `target` see either copy, never a mix."""
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+
+
+def sync_sqlite_replicas():
+    """Local stand-in for replication: refreshes every SQLite replica from the primary."""
+    primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+    synced = []
+    for alias in replica_aliases():
+        replica = settings.DATABASES[alias]
+        if replica['ENGINE'] == primary['ENGINE'] == 'django.db.backends.sqlite3':
+            sync_sqlite_database(str(primary['NAME']), str(replica['NAME']))
+            synced.append(alias)
+    return synced
@@ -0,0 +1,89 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Drops every field not listed in the `fields` serializer context entry.
+    Without that entry the serializer renders all of its fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """
+    `?fields=a,b` narrows the response and the SELECT column list (via
+    `only()`), `?expand=items` opts into nested data declared in
+    `expandable_fields` (name -> prefetch lookups). Both only apply to
+    `sparse_actions`, writes always take and return the full
+    representation. Without `?fields=` the full representation is returned,
+    so existing clients are unaffected; nested data is then always
+    prefetched.
+    """
+
+    expandable_fields = {}
+    # actions that render the queryset, others (e.g. state transitions) only
+    # need the row itself
+    sparse_actions = ('list', 'retrieve')
+
+    def _parse_list_param(self, name):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    def get_sparse_fields(self):
+        if hasattr(self, '_sparse_fields'):
+            return self._sparse_fields
+
+        requested = self._parse_list_param('fields')
+        expand = self._parse_list_param('expand') or []
+        available = set(self.get_serializer_class()().fields)
+
+        unknown = set(expand) - set(self.expandable_fields)
+        if requested is not None:
+            unknown |= set(requested) - available
+        if unknown:
+            raise ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+
+        if requested is None:
+            self._sparse_fields = None
+        else:
+            self._sparse_fields = set(requested) | set(expand)
+        return self._sparse_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # writes validate and save every field they were sent, a narrowed
+        # serializer would drop the rest of the payload
+        if self.action in self.sparse_actions:
+            context['fields'] = self.get_sparse_fields()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in self.sparse_actions:
+            return queryset
+        fields = self.get_sparse_fields()
+
+        for name, lookups in self.expandable_fields.items():
+            if fields is None or name in fields:
+                queryset = queryset.prefetch_related(*lookups)
+
+        if fields is not None:
+            columns = []
+            for name in fields:
+                try:
+                    field = queryset.model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+                if field.concrete:
+                    columns.append(name)
+            queryset = queryset.only(*columns or ['pk'])
+        return queryset
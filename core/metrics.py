@@ -0,0 +1,326 @@
+"""
+Small in-process metrics registry with Prometheus text exposition.
+
+Updates are a dict increment under a lock. When METRICS_DIR is set, every
+process periodically writes its snapshot to its own file there and the
+exposition endpoint sums all files, so counters and histograms aggregate
+across gunicorn workers. At scrape time the files of exited workers are
+folded into a single archive file and deleted, so the directory doesn't
+grow and counters never go backwards. Gauges are produced by collectors at
+scrape time.
+"""
+import bisect
+import fcntl
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger('metrics')
+
+FLUSH_INTERVAL = 5.0
+ARCHIVE_FILE = 'metrics_archive.json'
+# archive key listing the worker files already folded in, in case the
+# process died before it could delete them
+ABSORBED_KEY = '__absorbed__'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _write_json(path, data):
+    # unique temp file, so concurrent writers never rename each other's
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.metrics-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, owned by someone else
+        return True
+    return True
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            values[key] = values.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            values = self.registry.values[self.name]
+            # per-bucket (non cumulative) counts, then sum
+            state = values.get(key)
+            if state is None:
+                state = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+        self.registry.maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.metrics = {}
+        self.values = {}
+        self.collectors = []
+        self.started_at = time.time()
+        self._last_flush = 0.0
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        self.values[metric.name] = {}
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """`collector()` returns [(name, documentation, [(labels_dict, value), ...])] rendered as gauges."""
+        self.collectors.append(collector)
+        return collector
+
+    # multi-process aggregation
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def _own_file(self):
+        # pid + start time, so a recycled pid never overwrites an older worker's totals
+        return os.path.join(self.directory, f'metrics_{os.getpid()}_{int(self.started_at * 1000)}.json')
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(key), list(value) if isinstance(value, list) else value] for key, value in values.items()]
+                for name, values in self.values.items()
+            }
+
+    def maybe_flush(self):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        try:
+            self.flush()
+        except OSError:
+            # called after the write it counts has committed: losing a
+            # snapshot must never fail the request, the next flush catches up
+            logger.warning('Could not write metrics snapshot to %s', self.directory, exc_info=True)
+
+    def flush(self):
+        if not self.directory:
+            return
+        with self.flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_json(self._own_file(), self.snapshot())
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.directory, filename)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _worker_files(self):
+        """{filename: pid} of the snapshot files of other processes."""
+        own = os.path.basename(self._own_file())
+        files = {}
+        for filename in os.listdir(self.directory):
+            if filename in (own, ARCHIVE_FILE) or not filename.startswith('metrics_') or not filename.endswith('.json'):
+                continue
+            try:
+                files[filename] = int(filename.split('_')[1])
+            except (IndexError, ValueError):
+                continue
+        return files
+
+    @staticmethod
+    def _merge(merged, snapshot):
+        for name, entries in snapshot.items():
+            if name not in merged:
+                continue
+            for key, value in entries:
+                key = tuple(key)
+                current = merged[name].get(key)
+                if isinstance(value, list):
+                    merged[name][key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    merged[name][key] = value + (current or 0)
+
+    @contextmanager
+    def _locked(self, operation):
+        # pruning holds it exclusively, readers shared: a reader never sees a
+        # worker's file gone without its totals in the archive
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def prune(self):
+        """Folds the snapshots of exited workers into the archive file and deletes them."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        with self._locked(fcntl.LOCK_EX):
+            archive = self._read(ARCHIVE_FILE) or {}
+            absorbed = set(archive.pop(ABSORBED_KEY, []))
+            dead = [filename for filename, pid in self._worker_files().items() if not _is_alive(pid)]
+
+            fresh = [filename for filename in dead if filename not in absorbed]
+            if fresh:
+                totals = {name: {} for name in archive}
+                self._merge(totals, archive)
+                for filename in fresh:
+                    snapshot = self._read(filename) or {}
+                    for name in snapshot:
+                        totals.setdefault(name, {})
+                    self._merge(totals, snapshot)
+                archive = {
+                    name: [[list(key), value] for key, value in values.items()]
+                    for name, values in totals.items()
+                }
+                archive[ABSORBED_KEY] = fresh
+                _write_json(os.path.join(self.directory, ARCHIVE_FILE), archive)
+
+            for filename in dead:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def merged(self):
+        """Values of this process plus every other worker's last snapshot and the exited workers' totals."""
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            with self._locked(fcntl.LOCK_SH):
+                archive = self._read(ARCHIVE_FILE) or {}
+                absorbed = set(archive.pop(ABSORBED_KEY, []))
+                snapshots.append(archive)
+                for filename in self._worker_files():
+                    if filename in absorbed:
+                        continue
+                    snapshot = self._read(filename)
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            self._merge(merged, snapshot)
+        return merged
+
+    # exposition
+
+    def render(self):
+        self.flush()
+        self.prune()
+        lines = []
+        for name, values in self.merged().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for key, value in sorted(values.items()):
+                if metric.type == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                        cumulative += count
+                        labels = _format_labels(metric.labelnames, key, [('le', _format_value(bound))])
+                        lines.append(f'{name}_bucket{labels} {cumulative}')
+                    labels = _format_labels(metric.labelnames, key)
+                    lines.append(f'{name}_sum{labels} {_format_value(value[-1])}')
+                    lines.append(f'{name}_count{labels} {cumulative}')
+                else:
+                    lines.append(f'{name}{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+
+        for collector in self.collectors:
+            for name, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -1,5 +1,9 @@
 import uuid
 import logging
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from core.db_router import pin_primary, replica_aliases, unpin
+from core.retry import REQUEST_RETRIES, finish_request_retries, start_request_retries
 from django.utils.deprecation import MiddlewareMixin
 
 logger = logging.getLogger("request")
@@ -9,15 +13,63 @@ class RequestIDMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
         request.request_id = str(uuid.uuid4())
+        request._retries_token = start_request_retries()
 
     def process_response(self, request, response):
         request_id = getattr(request, "request_id", "-")
 
         response[self.HEADER_NAME] = request_id
 
+        token = getattr(request, "_retries_token", None)
+        retries = finish_request_retries(token) if token is not None else 0
+        REQUEST_RETRIES.observe(retries)
         logger.info(
-            "completed",
+            "completed" + (f" after {retries} db retries" if retries else ""),
             extra={"request_id": request_id},
         )
 
         return response
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """
+    Opts safe requests into replica reads. Unsafe requests run entirely on
+    the primary and set a short lived cookie, so the same client keeps
+    reading from the primary until the replicas have caught up
+    (REPLICA_STICKY_SECONDS). Anything outside a request reads from the
+    primary.
+    """
+    COOKIE_NAME = "use_primary"
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def process_request(self, request):
+        replica = request.method in self.SAFE_METHODS and self.COOKIE_NAME not in request.COOKIES
+        request._replica_pin = pin_primary(not replica)
+
+    def process_response(self, request, response):
+        if request.method not in self.SAFE_METHODS and replica_aliases():
+            response.set_cookie(
+                self.COOKIE_NAME, "1",
+                max_age=getattr(settings, "REPLICA_STICKY_SECONDS", 15),
+                httponly=True, samesite="Lax",
+            )
+        token = getattr(request, "_replica_pin", None)
+        if token is not None:
+            unpin(token)
+        return response
+
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware with a configurable size threshold (GZIP_MIN_LENGTH).
+    Small bodies aren't worth the CPU, and streaming responses (event
+    streams) are passed through untouched so every chunk reaches the client
+    immediately.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        if len(response.content) < getattr(settings, "GZIP_MIN_LENGTH", 1024):
+            return response
+        return super().process_response(request, response)
@@ -1,11 +1,31 @@
+from functools import partial
+from django.core.paginator import Paginator
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+
+class KnownCountPaginator(Paginator):
+    """Paginator that takes the row count from the caller instead of running COUNT(*)."""
+
+    def __init__(self, *args, count=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if count is not None:
+            # Paginator.count is a cached_property
+            self.__dict__['count'] = count
+
+
 class GlobalPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'per_page'
     max_page_size = 100
 
+    def paginate_queryset(self, queryset, request, view=None):
+        # views that already counted the filtered queryset (conditional GET
+        # fingerprint) expose it as `list_row_count`
+        count = getattr(view, 'list_row_count', None)
+        self.django_paginator_class = partial(KnownCountPaginator, count=count)
+        return super().paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
         return Response({
             'total_items': self.page.paginator.count,
@@ -15,4 +35,4 @@ class GlobalPagination(PageNumberPagination):
             'has_next': self.page.has_next(),
             'has_previous': self.page.has_previous(),
             'results': data
-        })
\ No newline at end of file
+        })
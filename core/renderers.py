@@ -1,16 +1,42 @@
 from rest_framework.renderers import JSONRenderer
 
+try:
+    import orjson
+except ImportError:  # optional speedup, falls back to DRF's stdlib json encoding
+    orjson = None
+
+
 class RequestIDJSONRenderer(JSONRenderer):
+    """
+    Adds `request_id` to dict responses and encodes with orjson when it is
+    installed. orjson serializes str/int/float/dict/list (and their
+    subclasses such as ReturnDict), UUID and datetime natively; anything else
+    (Decimal, lazy strings, querysets, ...) goes through DRF's encoder so the
+    output matches the stdlib renderer.
+    """
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
         request = renderer_context.get("request")
-        response = renderer_context.get("response")
 
-        if not request or not hasattr(request, "request_id"):
+        if request is not None and hasattr(request, "request_id") and isinstance(data, dict):
+            # the response data is built per request, so it is safe to add the key in place
+            data["request_id"] = request.request_id
+
+        if orjson is None or data is None or self.ensure_ascii:
             return super().render(data, accepted_media_type, renderer_context)
 
-        request_id = request.request_id
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context):
+            option |= orjson.OPT_INDENT_2
 
-        if isinstance(data, dict):
-            data["request_id"] = request_id
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=option)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits, let the stdlib encoder decide
+            return super().render(data, accepted_media_type, renderer_context)
 
-        return super().render(data, accepted_media_type, renderer_context)
+        # same strict-javascript-subset escaping as DRF's JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
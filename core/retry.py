@@ -0,0 +1,160 @@
+import functools
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from core.metrics import registry
+
+
+logger = logging.getLogger('db.retry')
+
+RETRIES = registry.counter(
+    'db_retries_total',
+    'Write operations retried after a lock or serialization error',
+    ['operation'],
+)
+RETRIES_EXHAUSTED = registry.counter(
+    'db_retries_exhausted_total',
+    'Write operations that failed after retrying, by reason (attempts or budget)',
+    ['operation', 'reason'],
+)
+REQUEST_RETRIES = registry.histogram(
+    'http_request_db_retries',
+    'Database retries per request',
+    buckets=(0, 1, 2, 3, 5, 10),
+)
+
+# SQLite reports lock contention as OperationalError('database is locked'),
+# PostgreSQL as serialization failure (40001) / deadlock (40P01)
+TRANSIENT_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'could not serialize access',
+    'deadlock detected',
+)
+TRANSIENT_PGCODES = ('40001', '40P01')
+
+_request_retries = ContextVar('request_retries', default=0)
+
+
+class RetriesExhausted(Exception):
+    """A transient database error persisted after retrying (or no retry budget was left)."""
+
+    def __init__(self, operation, attempts, reason):
+        self.operation = operation
+        self.attempts = attempts
+        self.reason = reason
+        super().__init__(f'{operation} failed after {attempts} attempt(s): {reason}')
+
+
+def is_transient_error(exc):
+    if not isinstance(exc, OperationalError):
+        return False
+    if getattr(exc.__cause__, 'pgcode', None) in TRANSIENT_PGCODES:
+        return True
+    message = str(exc).lower()
+    return any(text in message for text in TRANSIENT_MESSAGES)
+
+
+def start_request_retries():
+    return _request_retries.set(0)
+
+
+def finish_request_retries(token):
+    retries = _request_retries.get()
+    _request_retries.reset(token)
+    return retries
+
+
+class RetryBudget:
+    """
+    Caps retries at `ratio` of the calls plus `min_per_second`, so a
+    contended database gets a bounded amount of extra load instead of every
+    request multiplying its attempts.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=5, max_tokens=50):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, amount=0.0):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self.refilled_at) * self.min_per_second)
+        self.refilled_at = now
+
+    def deposit(self):
+        with self.lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Retries a transactional write path on lock and serialization errors
+    with full-jitter exponential backoff. It has to wrap the outermost
+    atomic block: inside a transaction the failed statement has already
+    poisoned it, so a call made within one runs once and any error
+    propagates to whoever owns that transaction.
+    """
+
+    def __init__(self, attempts=4, base_delay=0.01, max_delay=0.25, budget=None, using=DEFAULT_DB_ALIAS):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.using = using
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, operation, fn, *args, **kwargs):
+        if connections[self.using].in_atomic_block:
+            return fn(*args, **kwargs)
+
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_transient_error(exc):
+                    raise
+                attempt += 1
+                if attempt >= self.attempts:
+                    RETRIES_EXHAUSTED.inc(operation=operation, reason='attempts')
+                    raise RetriesExhausted(operation, attempt, str(exc)) from exc
+                if not self.budget.withdraw():
+                    RETRIES_EXHAUSTED.inc(operation=operation, reason='budget')
+                    raise RetriesExhausted(operation, attempt, 'retry budget exhausted') from exc
+                delay = self.backoff(attempt)
+                RETRIES.inc(operation=operation)
+                _request_retries.set(_request_retries.get() + 1)
+                logger.warning('%s: %s, retry %d in %.0f ms', operation, exc, attempt, delay * 1000)
+                time.sleep(delay)
+
+    def __call__(self, operation):
+        """Decorator form: `@db_retry('create_reservation')` above `@transaction.atomic`."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                return self.call(operation, fn, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+db_retry = RetryPolicy()
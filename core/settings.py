@@ -1,8 +1,8 @@
 
 from pathlib import Path
-from celery.schedules import crontab
+from datetime import timedelta
 import os
-from .app_vars import SECRET_KEY
+from .app_vars import SECRET_KEY, READ_REPLICA_DB
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,6 +30,8 @@ CUSTOM_APPS = [
 INSTALLED_APPS = DEFAULT_APPS + THIRD_PARTY_APPS + CUSTOM_APPS
 
 MIDDLEWARE = [
+    # first, so it compresses the final response body
+    'core.middleware.ThresholdGZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,6 +42,7 @@ MIDDLEWARE = [
     
     # custom middleware
     'core.middleware.RequestIDMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -69,6 +72,22 @@ DATABASES = {
     }
 }
 
+# Safe reads go to one of DATABASE_REPLICAS, writes, select_for_update and
+# reads inside transactions to default (core.db_router)
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+# how long a client keeps reading from the primary after a write, keep it
+# above the replication lag (here: the sync interval below)
+REPLICA_STICKY_SECONDS = 15
+
+if READ_REPLICA_DB:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': READ_REPLICA_DB,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -102,12 +121,32 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# responses smaller than this (bytes) are sent uncompressed
+GZIP_MIN_LENGTH = 1024
+
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": (
         "core.renderers.RequestIDJSONRenderer",
     )
 }
 
+# Where POST /api/reservations/ takes stock from, see inventory/reservation_store.py.
+RESERVATION_STORE = {
+    'BACKEND': os.environ.get('RESERVATION_STORE', 'inventory.reservation_store.DatabaseReservationStore'),
+    'OPTIONS': {},
+}
+
+# Long-poll and SSE clients of the stock change feed each hold a worker
+# thread while they wait; past this many per process they get a 503
+STOCK_FEED_MAX_WAITERS = int(os.environ.get('STOCK_FEED_MAX_WAITERS', 50))
+
+# Each worker writes its metric snapshot here so /metrics/ can sum them,
+# unset means per-process metrics only
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# the stock total gauge scans every product, scrapes reuse the last result
+# for this many seconds
+METRICS_STOCK_TOTALS_TTL = 60
+
 # Celery Configuration
 CELERY_BROKER_URL = 'memory://'
 CELERY_RESULT_BACKEND = 'rpc://'
@@ -120,7 +159,20 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULE = {
     'cleanup-expired-reservations': {
         'task': 'inventory.tasks.cleanup_expired_reservations',
-        'schedule': crontab(minute='*/5'),  # every 5 minutes
+        # plain intervals instead of crontab() so loading settings doesn't import celery
+        'schedule': timedelta(minutes=5),
+    },
+    'reconcile-stock-levels': {
+        'task': 'inventory.tasks.reconcile_stock_levels',
+        'schedule': timedelta(hours=1),  # incremental from the last watermark
+    },
+    'sync-read-replicas': {
+        'task': 'core.celery.sync_read_replicas',
+        'schedule': timedelta(seconds=10),
+    },
+    'compact-stock-change-feed': {
+        'task': 'inventory.tasks.compact_stock_change_feed',
+        'schedule': timedelta(minutes=15),
     },
 }
 
@@ -131,12 +183,19 @@ LOGGING = {
         "verbose": {
             "format": "[%(asctime)s] [%(levelname)s] [request_id=%(request_id)s] %(name)s: %(message)s",
         },
+        "simple": {
+            "format": "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s",
+        },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
             "formatter": "verbose",
         },
+        "simple_console": {
+            "class": "logging.StreamHandler",
+            "formatter": "simple",
+        },
     },
     "loggers": {
         "request": {
@@ -144,5 +203,15 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "db.retry": {
+            "handlers": ["simple_console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+        "metrics": {
+            "handlers": ["simple_console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     },
 }
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
-from .views import HealthCheckAPI, PopulateAPI
+from .views import HealthCheckAPI, PopulateAPI, metrics_view
 
 v1_api_patterns = [
     path('', include('inventory.urls')),
@@ -10,6 +10,7 @@ urlpatterns = [
     path('', HealthCheckAPI.as_view()),
     # path('admin/', admin.site.urls),
     path('populate/', PopulateAPI.as_view()),
+    path('metrics/', metrics_view),
     path('api/', include([
         path('', include(v1_api_patterns)), # for v1/, v2/,...etc
     ])),
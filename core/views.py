@@ -1,12 +1,7 @@
+from django.http import HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-import os
-import django
-from scripts.populate import populate_database
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.core.settings')
-django.setup()
 
 
 class HealthCheckAPI(APIView):
@@ -14,10 +9,43 @@ class HealthCheckAPI(APIView):
         return Response({"status": "ok"}, status=status.HTTP_200_OK)
 
 
+def metrics_view(request):
+    # plain Django view: Prometheus text format, no DRF content negotiation
+    from .metrics import registry
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class PopulateAPI(APIView):
+    # generate_dataset presets an unauthenticated request may ask for
+    SIZES = ('tiny', 'small')
+
     def post(self, request):
+        # dev tooling, imported on demand to keep it out of web worker startup
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+        from scripts.populate import populate_database
+
+        size = request.query_params.get('size') or request.data.get('size')
+        if size and size not in self.SIZES:
+            return Response(
+                {"error": f"Unknown size, choose one of: {', '.join(self.SIZES)} (larger presets: manage.py generate_dataset)"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            seed = int(request.data.get('seed', 42))
+        except (TypeError, ValueError):
+            return Response({"error": "seed must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
+            if size:
+                out = StringIO()
+                try:
+                    call_command('generate_dataset', preset=size, seed=seed, stdout=out)
+                except CommandError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+                return Response({"message": "Database populated successfully", "report": out.getvalue().splitlines()}, status=status.HTTP_200_OK)
             populate_database()
             return Response({"message": "Database populated successfully"}, status=status.HTTP_200_OK)
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
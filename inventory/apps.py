@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
     verbose_name = 'Inventory'
+
+    def ready(self):
+        from .search import ensure_search_index
+        from . import metrics  # noqa: F401, registers inventory metrics and gauges
+        post_migrate.connect(ensure_search_index, sender=self)
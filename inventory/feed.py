@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from .models import Product, StockChange
+
+
+MAX_FEED_LIMIT = 500
+POLL_INTERVAL = 0.5
+MAX_LONG_POLL = 30
+STREAM_DURATION = 300
+HEARTBEAT_INTERVAL = 15
+# entries younger than this are never compacted, so an in-flight reader
+# never sees a product's change move to a later sequence under it
+COMPACT_AFTER = timedelta(minutes=5)
+
+
+def record_stock_changes(product_ids, reason):
+    """Appends one feed entry per product, in the caller's transaction."""
+    entries = StockChange.objects.bulk_create([
+        StockChange(product_id=product_id, reason=reason)
+        for product_id in dict.fromkeys(product_ids)
+    ])
+    if entries:
+        transaction.on_commit(notifier.poke)
+
+
+class FeedBusy(Exception):
+    """Every waiting slot of this process is taken."""
+
+
+class ChangeNotifier:
+    """
+    Wakes waiting feed readers when the sequence moves past theirs.
+
+    One poller thread per process reads the latest sequence every
+    POLL_INTERVAL, and only while someone is waiting, so the database load
+    doesn't grow with the number of clients. Writers of this process poke
+    it on commit, changes from other processes are seen within one poll.
+    Waiting readers hold no database connection, but each holds a worker
+    thread: `slot()` caps them at STOCK_FEED_MAX_WAITERS per process.
+    """
+
+    def __init__(self, latest=None, poll_interval=POLL_INTERVAL):
+        self.read_latest = latest or latest_sequence
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.poked = threading.Event()
+        self.latest = None
+        self.waiters = 0
+        self.slots = 0
+        self.poller = None
+
+    def slot(self):
+        """Context manager holding one of the process' waiting slots, raises FeedBusy if none is left."""
+        with self.condition:
+            if self.slots >= settings.STOCK_FEED_MAX_WAITERS:
+                raise FeedBusy
+            self.slots += 1
+        return _Slot(self)
+
+    def _leave(self):
+        with self.condition:
+            self.slots -= 1
+
+    def poke(self):
+        self.poked.set()
+
+    def wait(self, since, timeout):
+        """Blocks until the sequence is past `since` or `timeout` seconds passed, returns whether it moved."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.waiters += 1
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, name='stock-feed-poller', daemon=True)
+                self.poller.start()
+            self.condition.notify_all()
+            try:
+                while self.latest is None or self.latest <= since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+                return True
+            finally:
+                self.waiters -= 1
+
+    def _poll(self):
+        while True:
+            with self.condition:
+                while not self.waiters:
+                    # idle: nobody to wake, don't keep a connection either
+                    connection.close()
+                    self.latest = None
+                    self.condition.wait()
+            latest = self.read_latest()
+            with self.condition:
+                if self.latest is None or latest > self.latest:
+                    self.latest = latest
+                    self.condition.notify_all()
+            self.poked.wait(self.poll_interval)
+            self.poked.clear()
+
+
+class _Slot:
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.notifier._leave()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ClosingStream:
+    """Streaming response content that gives its slot back when the response is closed."""
+
+    def __init__(self, events, slot):
+        self.events = events
+        self.slot = slot
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        self.events.close()
+        self.slot.release()
+
+
+def _release_connection():
+    # a request waiting on the feed doesn't need its connection, Django
+    # reopens one for the next query (never inside a transaction)
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def latest_sequence():
+    return StockChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def changes_since(since, limit=MAX_FEED_LIMIT):
+    """
+    Products whose stock changed after sequence `since`, coalesced: however
+    many times a product changed, it is returned once with its current
+    counters and the sequence of its last change. Returns (changes, next)
+    where `next` is the sequence to resume from.
+    """
+    limit = max(1, min(limit, MAX_FEED_LIMIT))
+    latest = list(
+        StockChange.objects.filter(seq__gt=since)
+        .values('product')
+        .annotate(last_seq=Max('seq'))
+        .order_by('last_seq')[:limit]
+    )
+    if not latest:
+        return [], since
+
+    products = Product.objects.only(
+        'available_stock', 'reserved_stock', 'total_stock'
+    ).in_bulk([row['product'] for row in latest])
+    changes = [
+        {
+            'seq': row['last_seq'],
+            'product': str(row['product']),
+            'available_stock': products[row['product']].available_stock,
+            'reserved_stock': products[row['product']].reserved_stock,
+            'total_stock': products[row['product']].total_stock,
+        }
+        for row in latest
+        # soft deleted products drop out of the feed
+        if row['product'] in products
+    ]
+    return changes, latest[-1]['last_seq']
+
+
+def wait_for_changes(since, timeout, limit=MAX_FEED_LIMIT):
+    """Long poll: returns as soon as there are changes, or empty after `timeout` seconds."""
+    changes, next_seq = changes_since(since, limit)
+    timeout = min(max(timeout, 0), MAX_LONG_POLL)
+    if changes or next_seq != since or not timeout:
+        return changes, next_seq
+    _release_connection()
+    if notifier.wait(since, timeout):
+        return changes_since(since, limit)
+    return [], since
+
+
+def event_stream(since, duration=STREAM_DURATION):
+    """
+    Server-Sent Events. Changes that land while the client is being served
+    are coalesced into a single event per product. The stream ends after
+    `duration` seconds, so a client gives its slot (and worker thread) back
+    regularly; EventSource reconnects with Last-Event-ID and resumes where
+    it stopped.
+    """
+    yield 'retry: 1000\n\n'
+    deadline = time.monotonic() + duration
+    woken = False
+    while (remaining := deadline - time.monotonic()) > 0:
+        changes, next_seq = changes_since(since)
+        for change in changes:
+            yield f"id: {change['seq']}\nevent: stock\ndata: {json.dumps(change)}\n\n"
+        if next_seq != since:
+            since = next_seq
+            continue
+        _release_connection()
+        if woken:
+            # woken but nothing to read yet (a lagging replica): don't spin
+            time.sleep(POLL_INTERVAL)
+        woken = notifier.wait(since, min(HEARTBEAT_INTERVAL, remaining))
+        if not woken:
+            yield ': keep-alive\n\n'
+
+
+notifier = ChangeNotifier()
+
+
+def compact_stock_changes(older_than=COMPACT_AFTER):
+    """
+    Deletes entries superseded by a newer entry of the same product. The
+    coalesced feed only reports each product's last change, so the result
+    of changes_since() is the same for any `since`, and the table stays
+    bounded by the number of products plus the recent changes.
+    """
+    # created_at grows with seq: walking back from the newest entry finds the
+    # cutoff after reading only the recent ones, without an index on created_at
+    cutoff = (
+        StockChange.objects.filter(created_at__lt=timezone.now() - older_than)
+        .order_by('-seq')
+        .values_list('seq', flat=True)
+        .first()
+    )
+    if cutoff is None:
+        return 0
+    newer = StockChange.objects.filter(product=OuterRef('product'), seq__gt=OuterRef('seq'))
+    deleted, _ = StockChange.objects.filter(seq__lte=cutoff).filter(Exists(newer)).delete()
+    return deleted
@@ -0,0 +1,280 @@
+import abc
+import gc
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from core.db_router import use_primary
+from inventory.models import Order, OrderStatus, Product, Reservation
+from inventory.serializers import OrderSerializer
+from inventory.services import audit_log, create_reservation, transition_order
+from inventory.tasks import cleanup_expired_reservations
+
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+DATASETS = ('tiny', 'small')
+PROFILE_ITERATIONS = 20
+CLEANUP_BATCH = 10
+SERIALIZER_PAGE = 20
+
+
+@contextmanager
+def throwaway_database(alias=DEFAULT_DB_ALIAS):
+    """
+    Points `alias` at a freshly migrated database for the duration and drops
+    it afterwards: the benchmarked operations commit for real, so they are
+    timed with their commits, and the project's database is never touched.
+    Inside a transaction (a test case) the run happens in a savepoint that
+    is rolled back instead.
+    """
+    db = connections[alias]
+    if db.in_atomic_block:
+        with transaction.atomic(using=alias):
+            yield
+            transaction.set_rollback(True, using=alias)
+        return
+
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    test_settings = db.settings_dict.setdefault('TEST', {})
+    saved = dict(test_settings)
+    if db.vendor == 'sqlite':
+        # a file, not the in-memory test database: commits should hit the disk
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    old_name = db.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # replicas still hold the project's data
+        with use_primary():
+            yield
+    finally:
+        db.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings.clear()
+        test_settings.update(saved)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class Benchmark(abc.ABC):
+    """
+    One hot path. `setup` prepares state for all iterations and
+    `before_each` for the next one, neither is timed; `run` is the
+    operation that is measured, each call in its own transaction(s).
+    """
+    name = None
+
+    def __init__(self, actor):
+        self.actor = actor
+
+    def setup(self, iterations):
+        pass
+
+    def before_each(self):
+        pass
+
+    @abc.abstractmethod
+    def run(self):
+        """The measured operation."""
+
+
+class TransitionOrder(Benchmark):
+    name = 'transition_order'
+
+    def setup(self, iterations):
+        orders = [Order(user=self.actor, total=10) for _ in range(iterations)]
+        Order.objects.bulk_create(orders)
+        self.orders = iter(orders)
+
+    def run(self):
+        transition_order(order=next(self.orders), new_status=OrderStatus.CONFIRMED, actor=self.actor)
+
+
+class AuditLogWrite(Benchmark):
+    name = 'audit_log'
+
+    def run(self):
+        audit_log(
+            action='benchmark',
+            object_type='Order',
+            object_id='00000000-0000-0000-0000-000000000000',
+            old_value={'status': 'pending'},
+            new_value={'status': 'confirmed'},
+            actor=self.actor,
+        )
+
+
+class CreateReservation(Benchmark):
+    name = 'create_reservation'
+
+    def setup(self, iterations):
+        self.product = Product.objects.create(name='Benchmark', total_stock=iterations, available_stock=iterations)
+
+    def run(self):
+        create_reservation(product_id=self.product.pk, quantity=1, actor=self.actor)
+
+
+class SerializeOrders(Benchmark):
+    name = 'serialize_orders'
+
+    def setup(self, iterations):
+        # the page is loaded once, only serialization is measured
+        self.orders = list(
+            Order.objects.order_by('-created_at')
+            .prefetch_related(Prefetch('items__product', queryset=Product.objects.order_by()))[:SERIALIZER_PAGE]
+        )
+
+    def run(self):
+        OrderSerializer(self.orders, many=True).data
+
+
+class CleanupSweep(Benchmark):
+    name = 'cleanup_expired_reservations'
+
+    def setup(self, iterations):
+        self.product = Product.objects.create(
+            name='Benchmark cleanup', total_stock=CLEANUP_BATCH, available_stock=CLEANUP_BATCH,
+        )
+
+    def before_each(self):
+        for _ in range(CLEANUP_BATCH):
+            create_reservation(product_id=self.product.pk, quantity=1, actor=self.actor)
+        Reservation.objects.active().filter(product=self.product).update(
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+
+    def run(self):
+        cleanup_expired_reservations()
+
+
+BENCHMARKS = [TransitionOrder, AuditLogWrite, CreateReservation, SerializeOrders, CleanupSweep]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time service-layer hot paths in process against a generated dataset, '
+        'report ops/sec, queries and allocations per op and compare with a JSON baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=DATASETS, default='tiny', help='generate_dataset preset to run against')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed operations per benchmark')
+        parser.add_argument('--only', nargs='*', choices=[b.name for b in BENCHMARKS], help='Run only these benchmarks')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help='Allowed relative regression of ops/sec and allocations (queries per op must not grow at all)',
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] <= 0:
+            raise CommandError('--iterations must be positive')
+        benchmarks = [b for b in BENCHMARKS if not options['only'] or b.name in options['only']]
+
+        with throwaway_database():
+            call_command('generate_dataset', preset=options['dataset'], seed=1, stdout=StringIO())
+            actor, _ = User.objects.get_or_create(username='benchmark')
+            results = {bench.name: self.measure(bench(actor), options['iterations']) for bench in benchmarks}
+
+        self.stdout.write(f"{'benchmark':<32}{'ops/sec':>12}{'queries/op':>12}{'peak KiB/op':>13}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<32}{result['ops_per_sec']:>12,.0f}{result['queries_per_op']:>12.1f}{result['peak_kib_per_op']:>13.1f}"
+            )
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as fh:
+                json.dump({'dataset': options['dataset'], 'results': results}, fh, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+            return
+
+        if os.path.exists(options['baseline']):
+            self.compare(results, options)
+
+    def measure(self, bench, iterations):
+        # timed pass without instrumentation, then a shorter profiling pass
+        # for queries and allocations (query capture and tracemalloc both
+        # distort timings)
+        profile_iterations = min(iterations, PROFILE_ITERATIONS)
+        bench.setup(iterations + profile_iterations + 1)
+        bench.before_each()
+        bench.run()  # warm up caches and lazy imports
+
+        timings = []
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # with DEBUG on, every query of the timed pass would be logged
+            with override_settings(DEBUG=False):
+                for _ in range(iterations):
+                    bench.before_each()
+                    started = time.perf_counter()
+                    bench.run()
+                    timings.append(time.perf_counter() - started)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        queries = 0
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(profile_iterations):
+                bench.before_each()
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                # the query log is a bounded deque, a full one would count 0 new queries
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as ctx:
+                    bench.run()
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+                queries += len(ctx.captured_queries)
+        finally:
+            tracemalloc.stop()
+
+        # the median op is far less sensitive to machine noise than the mean
+        median = statistics.median(timings)
+        return {
+            'ops_per_sec': 1 / median if median else float('inf'),
+            'queries_per_op': queries / profile_iterations,
+            'peak_kib_per_op': statistics.median(peaks) / 1024,
+        }
+
+    def compare(self, results, options):
+        with open(options['baseline']) as fh:
+            baseline = json.load(fh)
+        if baseline.get('dataset') != options['dataset']:
+            raise CommandError(f"Baseline was recorded on the {baseline.get('dataset')} dataset, not {options['dataset']}")
+
+        threshold = options['threshold']
+        regressions = []
+        for name, result in results.items():
+            expected = baseline['results'].get(name)
+            if expected is None:
+                continue
+            if result['ops_per_sec'] < expected['ops_per_sec'] * (1 - threshold):
+                regressions.append(f"{name}: {result['ops_per_sec']:,.0f} ops/sec, baseline {expected['ops_per_sec']:,.0f}")
+            if result['queries_per_op'] > expected['queries_per_op']:
+                regressions.append(f"{name}: {result['queries_per_op']:.1f} queries/op, baseline {expected['queries_per_op']:.1f}")
+            if result['peak_kib_per_op'] > expected['peak_kib_per_op'] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {result['peak_kib_per_op']:.1f} KiB/op, baseline {expected['peak_kib_per_op']:.1f}"
+                )
+
+        if regressions:
+            raise CommandError('Regressions against baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(f"No regressions against {options['baseline']} (threshold {threshold:.0%})")
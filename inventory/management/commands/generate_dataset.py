@@ -0,0 +1,277 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from core.db_router import use_primary
+from inventory.models import AuditLog, Order, OrderItem, OrderStatus, Product, Reservation, ReservationStatus
+from inventory.services import RESERVATION_TTL
+
+
+PRESETS = {
+    'tiny': {'products': 200, 'orders': 500, 'users': 20},
+    'small': {'products': 10_000, 'orders': 20_000, 'users': 500},
+    'medium': {'products': 200_000, 'orders': 500_000, 'users': 10_000},
+    'large': {'products': 1_000_000, 'orders': 2_000_000, 'users': 50_000},
+}
+
+ORDER_STATUS_WEIGHTS = {
+    OrderStatus.DELIVERED: 45,
+    OrderStatus.SHIPPED: 10,
+    OrderStatus.PROCESSING: 5,
+    OrderStatus.CONFIRMED: 10,
+    OrderStatus.PENDING: 20,
+    OrderStatus.CANCELLED: 10,
+}
+RESERVED_PRODUCT_RATIO = 0.1
+EXPIRED_RESERVATION_RATIO = 0.3
+RELEASED_RESERVATION_RATIO = 0.5
+HISTORY_DAYS = 365
+# rows per timestamp UPDATE
+STAMP_BATCH_SIZE = 500
+
+
+def insert_rows(model, rows, batch_size):
+    """
+    bulk_create that keeps the generated created_at / updated_at: the
+    auto_now / auto_now_add pre_save hooks stamp every row with "now", which
+    would flatten the date distribution, so the generated values are put
+    back with one CASE UPDATE per STAMP_BATCH_SIZE rows in the same
+    transaction. The CASE is written as SQL: building it from When()
+    expressions costs more than the insert itself.
+    """
+    connection = connections[router.db_for_write(model)]
+    pk = model._meta.pk
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    # generated values, before bulk_create's pre_save overwrites them
+    stamps = [
+        (pk.get_db_prep_value(row.pk, connection), [field.get_db_prep_value(getattr(row, field.attname), connection) for field in fields])
+        for row in rows
+    ]
+    model._base_manager.bulk_create(rows, batch_size=batch_size)
+
+    column = connection.ops.quote_name(pk.column)
+    for start in range(0, len(stamps), STAMP_BATCH_SIZE):
+        batch = stamps[start:start + STAMP_BATCH_SIZE]
+        sql = f'CASE {column} {" ".join(["WHEN %s THEN %s"] * len(batch))} END'
+        model._base_manager.filter(pk__in=[row.pk for row in rows[start:start + STAMP_BATCH_SIZE]]).update(**{
+            field.attname: RawSQL(sql, [param for key, values in batch for param in (key, values[i])], output_field=field)
+            for i, field in enumerate(fields)
+        })
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded synthetic dataset (products, orders, items, reservations, audit logs) with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+        parser.add_argument('--products', type=int, help='Override the preset product count')
+        parser.add_argument('--orders', type=int, help='Override the preset order count')
+        parser.add_argument('--users', type=int, help='Override the preset user count')
+        parser.add_argument('--seed', type=int, default=42, help='Same seed, same data: use a new seed to add another dataset')
+        parser.add_argument('--chunk-size', type=int, default=5_000, help='Rows per bulk_create batch')
+        parser.add_argument('--transaction-rows', type=int, default=200_000, help='Rows inserted per transaction')
+
+    @use_primary()
+    def handle(self, *args, **options):
+        config = dict(PRESETS[options['preset']])
+        for key in ('products', 'orders', 'users'):
+            if options[key] is not None:
+                config[key] = options[key]
+        if config['products'] <= 0 or config['users'] <= 0:
+            raise CommandError('At least one product and one user are required')
+
+        self.rng = random.Random(options['seed'])
+        self.seed = options['seed']
+        self.chunk_size = options['chunk_size']
+        self.transaction_rows = options['transaction_rows']
+        self.now = timezone.now()
+        # product pks derive from their index, so orders can reference any
+        # product without keeping millions of pks in memory
+        self.product_base = self.rng.getrandbits(128)
+        self.product_count = config['products']
+        self.counts = {}
+        if Product._base_manager.filter(pk=self.product_pk(0)).exists():
+            # same seed, same primary keys
+            raise CommandError(f'A dataset was already generated with seed {self.seed}, pass another --seed')
+
+        started = time.perf_counter()
+        user_ids = self.create_users(config['users'])
+        self.run('products, reservations', self.generate_products(config['products']))
+        self.run('orders, items', self.generate_orders(config['orders'], user_ids))
+        elapsed = time.perf_counter() - started
+
+        total = sum(self.counts.values())
+        for model, count in self.counts.items():
+            self.stdout.write(f'{model:<14}{count:>12,} rows')
+        self.stdout.write(f'Inserted {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/sec)')
+
+    def product_pk(self, index):
+        return uuid.UUID(int=self.product_base ^ index)
+
+    def product_price(self, index):
+        return Decimal((index * 7919) % 50_000 + 100) / 100
+
+    def pick_product(self):
+        # pareto-like popularity: low indexes are the best sellers
+        return min(int(self.rng.paretovariate(1.2)) - 1, self.product_count - 1)
+
+    def past(self, days=HISTORY_DAYS):
+        # recent activity is denser than old activity
+        return self.now - timedelta(seconds=int(days * 86400 * self.rng.random() ** 2))
+
+    def uuid4(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def create_users(self, count):
+        prefix = f'synthetic-{self.seed}-'
+        existing = set(User.objects.filter(username__startswith=prefix).values_list('username', flat=True))
+        User.objects.bulk_create(
+            [
+                User(username=f'{prefix}{i}', password='!')
+                for i in range(count) if f'{prefix}{i}' not in existing
+            ],
+            batch_size=self.chunk_size,
+        )
+        self.counts['User'] = count - len(existing)
+        return list(User.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+
+    def run(self, label, batches):
+        """Inserts the generated {model: [rows]} batches, committing every `transaction_rows`."""
+        started = time.perf_counter()
+        inserted = 0
+        batches = iter(batches)
+        exhausted = False
+        while not exhausted:
+            exhausted = True
+            pending = 0
+            with transaction.atomic():
+                for batch in batches:
+                    for model, rows in batch.items():
+                        insert_rows(model, rows, self.chunk_size)
+                        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(rows)
+                        pending += len(rows)
+                    if pending >= self.transaction_rows:
+                        exhausted = False
+                        break
+            inserted += pending
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label}: {inserted:,} rows in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):,.0f} rows/sec)')
+
+    def generate_products(self, count):
+        rng = self.rng
+        for start in range(0, count, self.chunk_size):
+            products, reservations, logs = [], [], []
+            for index in range(start, min(start + self.chunk_size, count)):
+                created_at = self.past()
+                updated_at = created_at
+                total = min(int(rng.lognormvariate(3, 1.2)), 10_000)
+                reserved = 0
+
+                if total and rng.random() < RESERVED_PRODUCT_RATIO:
+                    for _ in range(rng.randint(1, 3)):
+                        quantity = rng.randint(1, max(1, min(5, total - reserved)))
+                        if reserved + quantity > total:
+                            break
+                        expired = rng.random() < EXPIRED_RESERVATION_RATIO
+                        released = expired and rng.random() < RELEASED_RESERVATION_RATIO
+                        if expired:
+                            reserved_at = self.now - timedelta(minutes=rng.randint(11, 120))
+                        else:
+                            reserved_at = self.now - timedelta(minutes=rng.randint(0, 9))
+                        reservation = Reservation(
+                            uuid=self.uuid4(),
+                            product_id=self.product_pk(index),
+                            quantity=quantity,
+                            expires_at=reserved_at + RESERVATION_TTL,
+                            created_at=reserved_at,
+                            updated_at=reserved_at + RESERVATION_TTL if released else reserved_at,
+                            deleted_at=reserved_at + RESERVATION_TTL if released else None,
+                            status=ReservationStatus.EXPIRED if released else ReservationStatus.ACTIVE,
+                        )
+                        reservations.append(reservation)
+                        updated_at = max(updated_at, reservation.updated_at)
+                        logs.append(self.audit('reservation_created', 'Reservation', reservation.pk, None, {
+                            'product': str(reservation.product_id), 'quantity': quantity,
+                        }, reserved_at))
+                        if released:
+                            logs.append(self.audit('reservation_expired', 'Reservation', reservation.pk, {
+                                'product': str(reservation.product_id), 'quantity': quantity,
+                            }, None, reservation.deleted_at))
+                        else:
+                            # expired but not swept yet still holds stock
+                            reserved += quantity
+
+                products.append(Product(
+                    uuid=self.product_pk(index),
+                    name=f'Product {index:07d}',
+                    total_stock=total,
+                    available_stock=total - reserved,
+                    reserved_stock=reserved,
+                    created_at=created_at,
+                    updated_at=updated_at,
+                ))
+            yield {Product: products, Reservation: reservations, AuditLog: logs}
+
+    def generate_orders(self, count, user_ids):
+        rng = self.rng
+        statuses = list(ORDER_STATUS_WEIGHTS)
+        weights = list(ORDER_STATUS_WEIGHTS.values())
+        for start in range(0, count, self.chunk_size):
+            orders, items, logs = [], [], []
+            for _ in range(start, min(start + self.chunk_size, count)):
+                created_at = self.past()
+                order = Order(
+                    uuid=self.uuid4(),
+                    user_id=user_ids[min(int(rng.paretovariate(1.5)) - 1, len(user_ids) - 1)],
+                    status=rng.choices(statuses, weights)[0],
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+                total = Decimal(0)
+                # geometric number of items, mostly 1-2
+                for _ in range(min(1 + int(rng.expovariate(0.8)), 10)):
+                    index = self.pick_product()
+                    quantity = rng.randint(1, 3)
+                    price = self.product_price(index)
+                    total += price * quantity
+                    items.append(OrderItem(
+                        uuid=self.uuid4(),
+                        order=order,
+                        product_id=self.product_pk(index),
+                        quantity=quantity,
+                        price=price,
+                        created_at=created_at,
+                        updated_at=created_at,
+                    ))
+                order.total = total
+                if order.status != OrderStatus.PENDING:
+                    order.updated_at = min(created_at + timedelta(hours=rng.randint(1, 72)), self.now)
+                    logs.append(self.audit('status_changed', 'Order', order.pk, {'status': OrderStatus.PENDING}, {
+                        'status': order.status,
+                    }, order.updated_at))
+                orders.append(order)
+            yield {Order: orders, OrderItem: items, AuditLog: logs}
+
+    def audit(self, action, object_type, object_id, old_value, new_value, at):
+        return AuditLog(
+            uuid=self.uuid4(),
+            action=action,
+            object_type=object_type,
+            object_id=str(object_id),
+            old_value=old_value,
+            new_value=new_value,
+            timestamp=at,
+            created_at=at,
+            updated_at=at,
+        )
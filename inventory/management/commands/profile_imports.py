@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# what a web worker does before it can answer its first request
+BOOTSTRAP = """
+import time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure web worker cold start and report import time per module (python -X importtime)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of modules to list')
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+        parser.add_argument('--budget-ms', type=float, help='Fail if cold start takes longer than this')
+        parser.add_argument(
+            '--forbid', nargs='*', default=['celery', 'scripts'],
+            help='Top-level packages that must not be imported by a web worker',
+        )
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOTSTRAP],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+        total_ms = float(result.stdout.strip().splitlines()[-1])
+        index = 1 if options['sort'] == 'self' else 2
+        self.stdout.write(f"{'module':<60}{'self ms':>10}{'cumul ms':>10}")
+        for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[index], reverse=True)[:options['top']]:
+            self.stdout.write(f"{name:<60}{self_us / 1000:>10.1f}{cumulative_us / 1000:>10.1f}")
+        self.stdout.write(f"\n{len(modules)} modules imported, cold start {total_ms:.1f} ms")
+
+        errors = []
+        forbidden = sorted({
+            name for name, _, _ in modules
+            if name.split('.')[0] in options['forbid']
+        })
+        if forbidden:
+            errors.append(f"forbidden modules imported: {', '.join(forbidden[:10])}")
+        if options['budget_ms'] is not None and total_ms > options['budget_ms']:
+            errors.append(f"cold start {total_ms:.1f} ms exceeds budget of {options['budget_ms']:.1f} ms")
+        if errors:
+            raise CommandError('; '.join(errors))
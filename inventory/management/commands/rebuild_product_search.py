@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from core.db_router import use_primary
+from inventory.search import ensure_search_index, is_supported, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    @use_primary()
+    def handle(self, *args, **options):
+        if not is_supported():
+            raise CommandError('Product search index is only available on SQLite (FTS5)')
+        ensure_search_index(using=options['database'])
+        rebuild_search_index(using=options['database'])
+        self.stdout.write('Product search index rebuilt')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+from core.db_router import use_primary
+from inventory.services import reconcile_stock
+
+
+class Command(BaseCommand):
+    help = 'Verify product stock counters against live reservations, optionally repairing drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Check every product instead of resuming from the last watermark')
+        parser.add_argument('--since', help='ISO datetime to check from, overrides the stored watermark')
+        parser.add_argument('--repair', action='store_true', help='Rebuild drifted counters from live reservations')
+
+    @use_primary()
+    def handle(self, *args, **options):
+        since = parse_datetime(options['since']) if options['since'] else None
+        result = reconcile_stock(
+            since=since,
+            incremental=not options['full'],
+            repair=options['repair'],
+        )
+        self.stdout.write(
+            f"Checked {result['checked']} products, "
+            f"{result['mismatched']} mismatched, {result['repaired']} repaired"
+        )
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.db.models import Min, Sum
+from django.utils import timezone
+from core.metrics import registry
+from .models import Product, Reservation
+
+
+RESERVATIONS = registry.counter(
+    'inventory_reservations_total',
+    'Reservation attempts by outcome',
+    ['outcome'],
+)
+RESERVATION_LATENCY = registry.histogram(
+    'inventory_reservation_create_seconds',
+    'Latency of ReservationViewSet.create',
+)
+TRANSITIONS = registry.counter(
+    'inventory_order_transitions_total',
+    'Order status transitions',
+    ['from_status', 'to_status'],
+)
+TRANSITION_LATENCY = registry.histogram(
+    'inventory_order_transition_seconds',
+    'Latency of transition_order',
+)
+
+
+# (monotonic time, totals) of the last stock totals query
+_stock_totals = [None, None]
+
+
+def stock_totals():
+    """Reserved stock over all products, recomputed at most every METRICS_STOCK_TOTALS_TTL seconds."""
+    computed_at, totals = _stock_totals
+    now = time.monotonic()
+    if totals is None or now - computed_at >= getattr(settings, 'METRICS_STOCK_TOTALS_TTL', 60):
+        totals = Product.objects.aggregate(reserved=Sum('reserved_stock'))
+        _stock_totals[:] = [now, totals]
+    return totals
+
+
+@registry.register_collector
+def stock_gauges():
+    # the expiry query uses the partial active index and runs per scrape,
+    # the stock totals are a pass over products and are cached
+    oldest = Reservation.objects.expired().aggregate(oldest=Min('expires_at'))['oldest']
+    held = stock_totals()
+    return [
+        (
+            'inventory_oldest_expired_reservation_seconds',
+            'Age of the oldest expired reservation that has not been released yet',
+            [({}, (timezone.now() - oldest).total_seconds() if oldest else 0)],
+        ),
+        (
+            'inventory_reserved_stock',
+            'Total reserved stock across all products',
+            [({}, held['reserved'] or 0)],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-19 13:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['object_type', 'object_id', 'timestamp'], name='inventory_a_object__3fd8a0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['updated_at'], name='inventory_r_updated_0f0be8_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0 on 2026-10-19 13:59
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    # soft deleted reservations were all released by the expiry sweep
+    Reservation = apps.get_model('inventory', 'Reservation')
+    Reservation._base_manager.filter(deleted_at__isnull=False).update(status='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_list_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reservation',
+            name='inventory_r_expires_485198_idx',
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('consumed', 'Consumed'), ('expired', 'Expired'), ('released', 'Released')], default='active', max_length=16),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['expires_at'], name='reservation_active_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['product', 'quantity'], name='reservation_active_product_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0 on 2026-10-19 14:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_reservation_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('reason', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_changes', to='inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'seq'], name='inventory_s_product_29c0c9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-19 14:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_user(apps, schema_editor):
+    # the owner of an active reservation is whoever created it (audit
+    # object ids are hyphenated strings, so this is matched in Python)
+    AuditLog = apps.get_model('inventory', 'AuditLog')
+    Reservation = apps.get_model('inventory', 'Reservation')
+    active = {str(pk): pk for pk in Reservation._base_manager.filter(status='active').values_list('pk', flat=True)}
+    object_ids = list(active)
+    for start in range(0, len(object_ids), 500):
+        creators = AuditLog.objects.filter(
+            action='reservation_created', object_type='Reservation',
+            object_id__in=object_ids[start:start + 500], actor__isnull=False,
+        ).values_list('object_id', 'actor_id')
+        for object_id, actor_id in creators:
+            Reservation._base_manager.filter(pk=active[object_id]).update(user_id=actor_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_stock_change_feed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_user, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from core.abstract_model import BaseModel
+from core.abstract_model import BaseModel, SoftDeleteManager, SoftDeleteQuerySet
 
 
 class Product(BaseModel):
@@ -12,6 +12,19 @@ class Product(BaseModel):
 
     class Meta:
         ordering = ['-created_at']
+        # one index per filterable / sortable column of ProductViewSet, so no
+        # list query falls back to a table scan plus a temp b-tree sort,
+        # except available_stock / reserved_stock: every reservation writes
+        # them, an index there would slow down the hottest write path.
+        # The partial updated_at index covers the list fingerprint and the
+        # incremental reconciliation scan; being partial, it never looks more
+        # selective to the planner than the column a list is filtered on.
+        indexes = [
+            models.Index(fields=['updated_at'], condition=models.Q(deleted_at__isnull=True), name='product_live_updated_idx'),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['name']),
+            models.Index(fields=['total_stock']),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,16 +36,110 @@ class Product(BaseModel):
         super().save(*args, **kwargs)
 
 
+# holds the stock a product had before it was first stocked per warehouse
+DEFAULT_WAREHOUSE_CODE = 'default'
+
+
+class Warehouse(BaseModel):
+    name = models.CharField(max_length=255)
+    code = models.CharField(max_length=32, unique=True)
+
+    class Meta:
+        ordering = ['code']
+
+    def __str__(self):
+        return self.code
+
+
+class WarehouseStock(BaseModel):
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='stock')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='warehouse_stock')
+    total_stock = models.PositiveIntegerField(default=0)
+    available_stock = models.PositiveIntegerField(default=0)
+    reserved_stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'warehouse'], name='unique_product_warehouse'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.warehouse_id}"
+
+    def save(self, *args, **kwargs):
+        if self.available_stock + self.reserved_stock != self.total_stock:
+            raise ValueError("available_stock + reserved_stock must equal to total_stock")
+        super().save(*args, **kwargs)
+
+
+class ReservationStatus(models.TextChoices):
+    ACTIVE = 'active', 'Active'
+    CONSUMED = 'consumed', 'Consumed'
+    EXPIRED = 'expired', 'Expired'
+    RELEASED = 'released', 'Released'
+
+
+class ReservationQuerySet(SoftDeleteQuerySet):
+    def active(self):
+        return self.filter(status=ReservationStatus.ACTIVE)
+
+    def expired(self, now=None):
+        return self.active().filter(expires_at__lt=now or timezone.now())
+
+
+class ReservationManager(SoftDeleteManager):
+    def get_queryset(self):
+        return ReservationQuerySet(self.model, using=self._db).alive()
+
+    def all_objects(self):
+        return ReservationQuerySet(self.model, using=self._db)
+
+    def dead(self):
+        return ReservationQuerySet(self.model, using=self._db).dead()
+
+    def active(self):
+        return self.get_queryset().active()
+
+    def expired(self, now=None):
+        return self.get_queryset().expired(now)
+
+
 class Reservation(BaseModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # who may release it early, null for anonymous holds
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    # null for products that are not stocked per warehouse
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, null=True, blank=True)
     quantity = models.PositiveIntegerField()
     expires_at = models.DateTimeField()
+    # only active reservations hold stock, the others are kept (soft deleted) as history
+    status = models.CharField(max_length=16, choices=ReservationStatus.choices, default=ReservationStatus.ACTIVE)
+
+    objects = ReservationManager()
+
+    class Meta:
+        # partial indexes only contain active holds, so the cleanup sweep and
+        # the held-stock sums scale with live reservations, not with history.
+        # Queries must filter on status='active' for SQLite to pick them.
+        indexes = [
+            models.Index(fields=['updated_at']),
+            models.Index(
+                fields=['expires_at'], condition=models.Q(status='active'),
+                name='reservation_active_expiry_idx',
+            ),
+            models.Index(
+                fields=['product', 'quantity'], condition=models.Q(status='active'),
+                name='reservation_active_product_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.expires_at}"
 
     def is_expired(self):
-        return timezone.now() > self.expires_at
+        return self.status == ReservationStatus.EXPIRED or (
+            self.status == ReservationStatus.ACTIVE and timezone.now() > self.expires_at
+        )
 
 
 
@@ -52,6 +159,11 @@ TRANSITIONS = {
     OrderStatus.DELIVERED: set(),
     OrderStatus.CANCELLED: set(),
 }
+# statuses an order may be in right before moving to the key status
+PREDECESSORS = {
+    status: {source for source, targets in TRANSITIONS.items() if status in targets}
+    for status in OrderStatus
+}
 
 class Order(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -61,6 +173,9 @@ class Order(BaseModel):
     class Meta:
         indexes = [
             models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'total']),
+            # covers the unfiltered list fingerprint: count + max(updated_at) of live rows
+            models.Index(fields=['updated_at'], condition=models.Q(deleted_at__isnull=True), name='order_live_updated_idx'),
             models.Index(fields=['created_at', 'total']),
         ]
         ordering = ['-created_at']
@@ -84,3 +199,26 @@ class AuditLog(BaseModel):
     old_value = models.JSONField(null=True)
     new_value = models.JSONField(null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'timestamp']),
+        ]
+
+
+class StockChange(models.Model):
+    # append-only change feed, not a BaseModel: clients resume from an
+    # integer sequence, so the pk has to be monotonic
+    seq = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_changes', db_index=False)
+    reason = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # compaction: newer entry of the same product
+            models.Index(fields=['product', 'seq']),
+        ]
+
+    def __str__(self):
+        return f"{self.seq} {self.product_id} {self.reason}"
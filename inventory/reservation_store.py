@@ -0,0 +1,57 @@
+"""
+Reservation stores: where `POST /api/reservations/` takes stock from and
+where early releases go, selected with the RESERVATION_STORE setting.
+
+DatabaseReservationStore is the synchronous path: create_reservation and
+release_reservations, one transaction per call.
+"""
+import abc
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .services import create_reservation, release_reservations
+
+
+DEFAULT_BACKEND = 'inventory.reservation_store.DatabaseReservationStore'
+
+
+class ReservationStore(abc.ABC):
+    @abc.abstractmethod
+    def reserve(self, *, product_id, quantity, actor, warehouses=(), allow_split=False):
+        """Returns the created reservations, raises ValidationError when there isn't enough stock."""
+
+    def release(self, reservation_ids, *, actor):
+        """Releases reservations early, returns the ones that were still active."""
+        return release_reservations(reservation_ids, actor=actor)
+
+
+class DatabaseReservationStore(ReservationStore):
+    def __init__(self, **options):
+        pass
+
+    def reserve(self, *, product_id, quantity, actor, warehouses=(), allow_split=False):
+        return create_reservation(
+            product_id=product_id,
+            quantity=quantity,
+            actor=actor,
+            warehouses=warehouses,
+            allow_split=allow_split,
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_reservation_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = getattr(settings, 'RESERVATION_STORE', {})
+                backend = import_string(config.get('BACKEND', DEFAULT_BACKEND))
+                _store = backend(**config.get('OPTIONS', {}))
+    return _store
+
@@ -0,0 +1,217 @@
+import base64
+import json
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from .models import Product
+
+
+SEARCH_TABLE = 'inventory_product_fts'
+# stable integer ids for the FTS rowids: the product table has a UUID pk,
+# and its implicit rowid may be renumbered by VACUUM
+SEARCH_IDS_TABLE = 'inventory_product_search_ids'
+# columns of inventory_product indexed for search, add descriptive fields here
+SEARCH_FIELDS = ('name',)
+MAX_SEARCH_LIMIT = 100
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def _trigger_sql(table, fields):
+    columns = ', '.join(fields)
+    new_values = ', '.join(f'new.{field}' for field in fields)
+    old_values = ', '.join(f'old.{field}' for field in fields)
+    product_table = Product._meta.db_table
+    # the index is contentless, so a delete has to repeat the indexed values
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {product_table} BEGIN
+            INSERT OR IGNORE INTO {SEARCH_IDS_TABLE}(product) VALUES (new.uuid);
+            INSERT INTO {table}(rowid, {columns})
+                SELECT id, {new_values} FROM {SEARCH_IDS_TABLE} WHERE product = new.uuid;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {product_table} BEGIN
+            INSERT INTO {table}({table}, rowid, {columns})
+                SELECT 'delete', id, {old_values} FROM {SEARCH_IDS_TABLE} WHERE product = old.uuid;
+            DELETE FROM {SEARCH_IDS_TABLE} WHERE product = old.uuid;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF {columns} ON {product_table} BEGIN
+            INSERT INTO {table}({table}, rowid, {columns})
+                SELECT 'delete', id, {old_values} FROM {SEARCH_IDS_TABLE} WHERE product = old.uuid;
+            INSERT INTO {table}(rowid, {columns})
+                SELECT id, {new_values} FROM {SEARCH_IDS_TABLE} WHERE product = new.uuid;
+        END
+        """,
+    ]
+
+
+def ensure_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the FTS5 table, its id mapping and the sync triggers when they
+    are missing.
+
+    Hooked to post_migrate: SQLite drops triggers whenever a migration
+    rebuilds the product table, so they are re-created (and the index
+    rebuilt) after every migrate instead of only in an initial migration.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    product_table = Product._meta.db_table
+    tables = db.introspection.table_names()
+    if product_table not in tables:
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+            [f'{SEARCH_TABLE}_ai', f'{SEARCH_TABLE}_ad', f'{SEARCH_TABLE}_au'],
+        )
+        if cursor.fetchone()[0] == 3 and SEARCH_IDS_TABLE in tables:
+            return
+
+        if SEARCH_IDS_TABLE not in tables:
+            # an index keyed on the product rowid: replaced, not migrated
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+            cursor.execute(
+                f'CREATE TABLE {SEARCH_IDS_TABLE} (id INTEGER PRIMARY KEY, product TEXT NOT NULL UNIQUE)'
+            )
+        cursor.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+                {', '.join(SEARCH_FIELDS)},
+                content='',
+                prefix='2 3',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+        for statement in _trigger_sql(SEARCH_TABLE, SEARCH_FIELDS):
+            cursor.execute(statement)
+    rebuild_search_index(using)
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    product_table = Product._meta.db_table
+    columns = ', '.join(SEARCH_FIELDS)
+    values = ', '.join(f'p.{field}' for field in SEARCH_FIELDS)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_IDS_TABLE} WHERE product NOT IN (SELECT uuid FROM {product_table})')
+        cursor.execute(f'INSERT OR IGNORE INTO {SEARCH_IDS_TABLE}(product) SELECT uuid FROM {product_table}')
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('delete-all')")
+        cursor.execute(
+            f"""
+            INSERT INTO {SEARCH_TABLE}(rowid, {columns})
+            SELECT ids.id, {values} FROM {SEARCH_IDS_TABLE} ids JOIN {product_table} p ON p.uuid = ids.product
+            """
+        )
+
+
+def build_match_expression(query):
+    # every token becomes a quoted prefix term, so user input can't inject FTS5 syntax
+    tokens = TOKEN_RE.findall(query)
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, types):
+    """The [value, ...] list of an `encode_cursor` cursor, checked against `types`."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValidationError('Invalid cursor')
+    # bool is an int, but never a valid keyset value
+    if not (
+        isinstance(values, list) and len(values) == len(types)
+        and all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types))
+    ):
+        raise ValidationError('Invalid cursor')
+    return values
+
+
+def search_products(query, limit=20, cursor=None):
+    """
+    Ranked prefix / full-text search over products with keyset pagination.
+    Returns (products, next_cursor).
+    """
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if is_supported():
+        # (bm25 score, search id)
+        after = decode_cursor(cursor, ((int, float), int)) if cursor else None
+        return _search_fts(query, limit, after)
+    # (name, uuid)
+    after = decode_cursor(cursor, (str, str)) if cursor else None
+    return _search_fallback(query, limit, after)
+
+
+def _search_fts(query, limit, after):
+    expression = build_match_expression(query)
+    if not expression:
+        return [], None
+
+    product_table = Product._meta.db_table
+    params = [expression]
+    keyset = ''
+    if after:
+        keyset = 'AND (search.score > %s OR (search.score = %s AND search.rowid > %s))'
+        params += [after[0], after[0], after[1]]
+    params.append(limit + 1)
+
+    products = list(Product.objects.raw(
+        f"""
+        SELECT p.*, search.score AS search_rank, search.rowid AS search_rowid
+        FROM (
+            SELECT rowid, bm25({SEARCH_TABLE}) AS score
+            FROM {SEARCH_TABLE}
+            WHERE {SEARCH_TABLE} MATCH %s
+        ) AS search
+        JOIN {SEARCH_IDS_TABLE} ids ON ids.id = search.rowid
+        JOIN {product_table} p ON p.uuid = ids.product
+        WHERE p.deleted_at IS NULL {keyset}
+        ORDER BY search.score, search.rowid
+        LIMIT %s
+        """,
+        params,
+    ))
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor([last.search_rank, last.search_rowid])
+    return products, next_cursor
+
+
+def _search_fallback(query, limit, after):
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return [], None
+
+    products = Product.objects.filter(name__istartswith=tokens[0])
+    for token in tokens[1:]:
+        products = products.filter(name__icontains=token)
+    if after:
+        products = products.filter(name__gte=after[0]).exclude(name=after[0], uuid__lte=after[1])
+    products = list(products.order_by('name', 'uuid')[:limit + 1])
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor([last.name, str(last.uuid)])
+    return products, next_cursor
@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from .models import Product, Reservation, Order, OrderItem, AuditLog
+from core.fieldsets import SparseFieldsetSerializerMixin
 # import uuid
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
@@ -11,7 +12,7 @@ class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = '__all__'
-        read_only_fields = ['id', 'expires_at', 'created_at']
+        read_only_fields = ['id', 'user', 'expires_at', 'created_at']
 
     def validate_quantity(self, value):
         if not value or value <= 0:
@@ -25,13 +26,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['product', 'product_name', 'quantity', 'price']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'status', 'created_at', 'total', 'items']
-        read_only_fields = ['id', 'created_at']
+        fields = ['uuid', 'user', 'status', 'created_at', 'total', 'items']
+        read_only_fields = ['uuid', 'created_at']
 
 class AuditLogSerializer(serializers.ModelSerializer):
     class Meta:
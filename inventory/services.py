@@ -1,6 +1,24 @@
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from .models import Order, AuditLog
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from collections import Counter
+from datetime import timedelta
+from core.db_router import use_primary
+from core.retry import db_retry
+from .models import (
+    DEFAULT_WAREHOUSE_CODE, PREDECESSORS, AuditLog, Order, Product, Reservation, ReservationStatus, Warehouse,
+    WarehouseStock,
+)
+from .feed import record_stock_changes
+from .metrics import TRANSITIONS, TRANSITION_LATENCY
+
+
+RESERVATION_TTL = timedelta(minutes=10)
+RECONCILIATION_OBJECT_ID = 'stock_reconciliation'
+RECONCILIATION_CHUNK_SIZE = 1000
 
 
 def audit_log(action, object_type, object_id, old_value, new_value, actor):
@@ -14,16 +32,50 @@ def audit_log(action, object_type, object_id, old_value, new_value, actor):
     )
 
 
-@transaction.atomic
 def transition_order(*, order: Order, new_status: str, actor):
-    if not order.can_transition_to(new_status):
-        raise ValidationError(
-            f"Invalid transition from {order.status} to {new_status}"
+    with TRANSITION_LATENCY.time():
+        old_status = _transition_order(order=order, new_status=new_status, actor=actor)
+    TRANSITIONS.inc(from_status=old_status, to_status=new_status)
+
+
+class TransitionConflict(Exception):
+    """Another request changed the order between it being read and the transition."""
+
+    def __init__(self, order, new_status, current_status):
+        self.order = order
+        self.new_status = new_status
+        self.current_status = current_status
+        super().__init__(
+            f"Order changed to {current_status} concurrently, cannot move it from {order.status} to {new_status}"
         )
 
+
+@db_retry('transition_order')
+@transaction.atomic
+def _transition_order(*, order, new_status, actor):
+    """
+    Compare-and-swap: a single conditional UPDATE that only matches while the
+    row still has the status this instance was read with. No row lock is
+    held while Python decides; if another request got there first, nothing
+    is written and TransitionConflict is raised.
+    """
     old_status = order.status
+    if old_status not in PREDECESSORS.get(new_status, ()):
+        raise ValidationError(
+            f"Invalid transition from {old_status} to {new_status}"
+        )
+
+    now = timezone.now()
+    updated = Order.objects.filter(pk=order.pk, status=old_status).update(
+        status=new_status,
+        # .update() skips auto_now
+        updated_at=now,
+    )
+    if not updated:
+        current = Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+        raise TransitionConflict(order, new_status, current)
     order.status = new_status
-    order.save(update_fields=["status"])
+    order.updated_at = now
 
     audit_log(
         action="status_changed",
@@ -33,3 +85,412 @@ def transition_order(*, order: Order, new_status: str, actor):
         new_value={"status": new_status},
         actor=actor,
     )
+    return old_status
+
+
+def plan_allocation(stock_rows, quantity, preference=(), allow_split=False):
+    """
+    Picks warehouses for `quantity` units. Preferred warehouse codes come
+    first in the given order, the rest are tried by most available stock so
+    that load spreads away from nearly exhausted (and most contended) rows.
+    A single warehouse that can fill the whole quantity always wins; with
+    `allow_split` the quantity is spread over several warehouses instead.
+    Returns a list of (stock_row, quantity) or an empty list.
+    """
+    rank = {code: index for index, code in enumerate(preference)}
+    candidates = sorted(
+        (row for row in stock_rows if row.available_stock > 0),
+        key=lambda row: (rank.get(row.warehouse.code, len(rank)), -row.available_stock),
+    )
+
+    for row in candidates:
+        if row.available_stock >= quantity:
+            return [(row, quantity)]
+
+    if not allow_split:
+        return []
+
+    plan = []
+    remaining = quantity
+    for row in candidates:
+        take = min(row.available_stock, remaining)
+        plan.append((row, take))
+        remaining -= take
+        if not remaining:
+            return plan
+    return []
+
+
+def _stock_delta(available, reserved, total=0):
+    return {
+        'available_stock': F('available_stock') + available,
+        'reserved_stock': F('reserved_stock') + reserved,
+        'total_stock': F('total_stock') + total,
+        # .update() skips auto_now, bump it so list ETags and reconciliation see the change
+        'updated_at': timezone.now(),
+    }
+
+
+def stock_unavailable(product_id):
+    """The error for a reservation that can't be served, its code tells a missing product from a short one."""
+    code = 'insufficient_stock' if Product.objects.filter(pk=product_id).exists() else 'not_found'
+    return ValidationError('Not enough stock or product not found', code=code)
+
+
+@db_retry('create_reservation')
+@transaction.atomic
+def create_reservation(*, product_id, quantity, actor, warehouses=(), allow_split=False):
+    """
+    Moves `quantity` units from available to reserved and records the hold.
+
+    Products without warehouse stock keep the single conditional UPDATE on
+    the product row. Warehouse-stocked products lock their stock rows in
+    warehouse pk order, then the product row, so concurrent allocations
+    always acquire locks in the same order. Product counters are kept equal
+    to the sum of their warehouse rows by applying the same deltas.
+    """
+    stock_rows = list(
+        WarehouseStock.objects.select_for_update()
+        .filter(product_id=product_id)
+        .select_related('warehouse')
+        .order_by('warehouse_id')
+    )
+
+    if stock_rows:
+        plan = plan_allocation(stock_rows, quantity, warehouses, allow_split)
+        if not plan:
+            raise stock_unavailable(product_id)
+        for row, row_quantity in plan:
+            updated = WarehouseStock.objects.filter(
+                pk=row.pk,
+                available_stock__gte=row_quantity,
+            ).update(**_stock_delta(-row_quantity, row_quantity))
+            if not updated:
+                raise stock_unavailable(product_id)
+    else:
+        plan = [(None, quantity)]
+
+    updated = Product.objects.filter(
+        pk=product_id,
+        available_stock__gte=quantity,
+    ).update(**_stock_delta(-quantity, quantity))
+    if not updated:
+        raise stock_unavailable(product_id)
+
+    record_stock_changes([product_id], 'reservation_created')
+
+    expires_at = timezone.now() + RESERVATION_TTL
+    reservations = Reservation.objects.bulk_create([
+        Reservation(
+            product_id=product_id,
+            user=actor,
+            warehouse=row.warehouse if row else None,
+            quantity=row_quantity,
+            expires_at=expires_at,
+        )
+        for row, row_quantity in plan
+    ])
+    for reservation in reservations:
+        new_value = {
+            'product': str(product_id),
+            'quantity': reservation.quantity,
+        }
+        if reservation.warehouse_id:
+            new_value['warehouse'] = reservation.warehouse.code
+        audit_log(
+            action='reservation_created',
+            object_type='Reservation',
+            object_id=str(reservation.pk),
+            old_value=None,
+            new_value=new_value,
+            actor=actor,
+        )
+    return reservations
+
+
+@db_retry('release_reservation')
+@transaction.atomic
+def release_reservation(reservation, *, status=ReservationStatus.EXPIRED, actor=None):
+    """
+    Returns a reservation's quantity to available stock and moves it out of
+    `active` (to `expired` or `released`). The row is claimed with a
+    conditional UPDATE on status first, so two sweeps racing on the same
+    reservation release its stock only once.
+    """
+    now = timezone.now()
+    claimed = Reservation.objects.active().filter(pk=reservation.pk).update(
+        status=status,
+        deleted_at=now,
+        updated_at=now,
+    )
+    if not claimed:
+        return False
+    reservation.status = status
+
+    quantity = reservation.quantity
+    Product.objects.filter(pk=reservation.product_id).update(**_stock_delta(quantity, -quantity))
+    if reservation.warehouse_id:
+        WarehouseStock.objects.filter(
+            product_id=reservation.product_id,
+            warehouse_id=reservation.warehouse_id,
+        ).update(**_stock_delta(quantity, -quantity))
+    record_stock_changes([reservation.product_id], f'reservation_{status}')
+
+    audit_log(
+        action=f'reservation_{status}',
+        object_type='Reservation',
+        object_id=str(reservation.pk),
+        old_value={'product': str(reservation.product_id), 'quantity': quantity},
+        new_value=None,
+        actor=actor,
+    )
+    return True
+
+
+@db_retry('release_reservations')
+@transaction.atomic
+def release_reservations(reservation_ids, *, actor):
+    """
+    Releases `actor`'s active reservations early and returns their stock right away.
+    All rows are claimed with a single conditional UPDATE, then the stock
+    goes back with one UPDATE per product (and per warehouse), so a cart of
+    any size costs a fixed number of statements per product. Returns the
+    released reservations; ids that are unknown, no longer active or
+    someone else's are skipped.
+    """
+    now = timezone.now()
+    claimed = Reservation.objects.active().filter(pk__in=reservation_ids, user=actor).update(
+        status=ReservationStatus.RELEASED,
+        deleted_at=now,
+        updated_at=now,
+    )
+    if not claimed:
+        return []
+    # the claim holds the rows until commit, `now` tells ours from earlier releases
+    released = list(
+        Reservation.objects.all_objects()
+        .filter(pk__in=reservation_ids, status=ReservationStatus.RELEASED, deleted_at=now)
+        .only('pk', 'product_id', 'warehouse_id', 'quantity', 'status')
+    )
+
+    by_product, by_warehouse = Counter(), Counter()
+    for reservation in released:
+        by_product[reservation.product_id] += reservation.quantity
+        if reservation.warehouse_id:
+            by_warehouse[reservation.product_id, reservation.warehouse_id] += reservation.quantity
+    for product_id, quantity in by_product.items():
+        Product.objects.filter(pk=product_id).update(**_stock_delta(quantity, -quantity))
+    for (product_id, warehouse_id), quantity in by_warehouse.items():
+        WarehouseStock.objects.filter(product_id=product_id, warehouse_id=warehouse_id).update(
+            **_stock_delta(quantity, -quantity)
+        )
+    record_stock_changes(by_product, 'reservation_released')
+
+    AuditLog.objects.bulk_create([
+        AuditLog(
+            actor=actor,
+            action='reservation_released',
+            object_type='Reservation',
+            object_id=str(reservation.pk),
+            old_value={'product': str(reservation.product_id), 'quantity': reservation.quantity},
+            new_value=None,
+        )
+        for reservation in released
+    ])
+    return released
+
+
+def move_stock_to_default_warehouse(product_id, actor=None):
+    """
+    Puts the stock a product holds outside any warehouse, and its active
+    reservations, into the default warehouse, so its counters stay the sum
+    of its warehouse rows. Callers run it in a transaction.
+    """
+    product = Product.objects.select_for_update().get(pk=product_id)
+    if not product.total_stock:
+        return None
+    warehouse, _ = Warehouse.objects.get_or_create(code=DEFAULT_WAREHOUSE_CODE, defaults={'name': 'Default'})
+    stock = WarehouseStock.objects.create(
+        product=product,
+        warehouse=warehouse,
+        total_stock=product.total_stock,
+        available_stock=product.available_stock,
+        reserved_stock=product.reserved_stock,
+    )
+    Reservation.objects.active().filter(product=product, warehouse__isnull=True).update(warehouse=warehouse)
+    audit_log(
+        action='stock_moved',
+        object_type='WarehouseStock',
+        object_id=str(stock.pk),
+        old_value=None,
+        new_value={'warehouse': warehouse.code, 'product': str(product.pk), 'total_stock': product.total_stock},
+        actor=actor,
+    )
+    return stock
+
+
+@transaction.atomic
+def adjust_warehouse_stock(*, product, warehouse, delta, actor):
+    """
+    Adds (or with a negative delta removes) sellable units in one warehouse
+    and applies the same delta to the product totals. Once a product has
+    warehouse rows its counters are the sum of them: stock it had before
+    its first warehouse row moves to the default warehouse.
+    """
+    if not WarehouseStock.objects.filter(product=product).exists():
+        move_stock_to_default_warehouse(product.pk, actor)
+    stock, _ = WarehouseStock.objects.get_or_create(product=product, warehouse=warehouse)
+    if delta < 0:
+        updated = WarehouseStock.objects.filter(pk=stock.pk, available_stock__gte=-delta).update(
+            **_stock_delta(delta, 0, delta)
+        )
+        if not updated:
+            raise ValidationError('Not enough available stock to remove')
+    else:
+        WarehouseStock.objects.filter(pk=stock.pk).update(**_stock_delta(delta, 0, delta))
+    Product.objects.filter(pk=product.pk).update(**_stock_delta(delta, 0, delta))
+    record_stock_changes([product.pk], 'stock_adjusted')
+
+    audit_log(
+        action='stock_adjusted',
+        object_type='WarehouseStock',
+        object_id=str(stock.pk),
+        old_value={'total_stock': stock.total_stock, 'available_stock': stock.available_stock},
+        new_value={'delta': delta, 'warehouse': warehouse.code, 'product': str(product.pk)},
+        actor=actor,
+    )
+    stock.refresh_from_db()
+    return stock
+
+
+def live_reserved_quantity():
+    # sum of live reservations per product, evaluated inside the product query
+    return Coalesce(
+        Subquery(
+            Reservation.objects.active().filter(product=OuterRef('pk'))
+            .order_by()
+            .values('product')
+            .annotate(total=Sum('quantity'))
+            .values('total')[:1]
+        ),
+        Value(0),
+    )
+
+
+def warehouse_total_stock():
+    # sum of warehouse rows per product, products without rows compare to themselves
+    return Coalesce(
+        Subquery(
+            WarehouseStock.objects.filter(product=OuterRef('pk'))
+            .order_by()
+            .values('product')
+            .annotate(total=Sum('total_stock'))
+            .values('total')[:1]
+        ),
+        F('total_stock'),
+    )
+
+
+def last_reconciliation_watermark():
+    summary = (
+        AuditLog.objects.filter(object_type='System', object_id=RECONCILIATION_OBJECT_ID)
+        .order_by('-timestamp')
+        .values_list('new_value', flat=True)
+        .first()
+    )
+    if not summary:
+        return None
+    return parse_datetime(summary['watermark'])
+
+
+@use_primary()
+def reconcile_stock(*, since=None, incremental=True, repair=False, actor=None):
+    """
+    Checks `available + reserved = total`, `reserved_stock = sum(live
+    reservations)` and, for warehouse-stocked products, `total_stock =
+    sum(warehouse totals)` for every product touched since the last run,
+    using set-based queries only. With `repair`, drifted counters are rebuilt from
+    the live reservations in chunked UPDATEs.
+    """
+    started_at = timezone.now()
+    if since is None and incremental:
+        since = last_reconciliation_watermark()
+
+    products = Product.objects.all()
+    if since is not None:
+        products = products.filter(
+            Q(updated_at__gte=since)
+            | Q(pk__in=Reservation.objects.all_objects().filter(updated_at__gte=since).values('product'))
+        )
+
+    checked = products.count()
+    mismatched = (
+        products.order_by()
+        .alias(
+            live_reserved=live_reserved_quantity(),
+            warehouse_total=warehouse_total_stock(),
+        )
+        .filter(
+            ~Q(total_stock=F('available_stock') + F('reserved_stock'))
+            | ~Q(reserved_stock=F('live_reserved'))
+            | ~Q(total_stock=F('warehouse_total'))
+        )
+        .values_list('pk', flat=True)
+    )
+
+    mismatched_ids = list(mismatched)
+    repaired = 0
+    if repair:
+        for start in range(0, len(mismatched_ids), RECONCILIATION_CHUNK_SIZE):
+            repaired += _repair_stock(mismatched_ids[start:start + RECONCILIATION_CHUNK_SIZE], actor)
+
+    result = {
+        'watermark': started_at.isoformat(),
+        'since': since.isoformat() if since else None,
+        'checked': checked,
+        'mismatched': len(mismatched_ids),
+        'repaired': repaired,
+    }
+    audit_log(
+        action='stock_reconciled',
+        object_type='System',
+        object_id=RECONCILIATION_OBJECT_ID,
+        old_value={'mismatched_products': [str(pk) for pk in mismatched_ids[:100]]},
+        new_value=result,
+        actor=actor,
+    )
+    return result
+
+
+@transaction.atomic
+def _repair_stock(product_ids, actor):
+    live_reserved = live_reserved_quantity()
+    # products whose live reservations exceed total stock can't be fixed by
+    # recomputing counters, they are reported as mismatched only
+    repairable = Product.objects.filter(pk__in=product_ids, total_stock__gte=live_reserved)
+    before = list(repairable.values('pk', 'available_stock', 'reserved_stock'))
+    repairable_ids = [row['pk'] for row in before]
+
+    repaired = Product.objects.filter(pk__in=repairable_ids).update(
+        reserved_stock=live_reserved,
+        available_stock=F('total_stock') - live_reserved,
+        updated_at=timezone.now(),
+    )
+    after = Product.objects.in_bulk(repairable_ids)
+    record_stock_changes(repairable_ids, 'stock_repaired')
+
+    AuditLog.objects.bulk_create([
+        AuditLog(
+            actor=actor,
+            action='stock_repaired',
+            object_type='Product',
+            object_id=str(row['pk']),
+            old_value={'available_stock': row['available_stock'], 'reserved_stock': row['reserved_stock']},
+            new_value={
+                'available_stock': after[row['pk']].available_stock,
+                'reserved_stock': after[row['pk']].reserved_stock,
+            },
+        )
+        for row in before
+    ])
+    return repaired
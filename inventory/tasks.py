@@ -1,34 +1,36 @@
 from celery import shared_task
-from django.db import transaction
-from django.utils import timezone
+from core.db_router import use_primary
+from core.retry import RetriesExhausted
 from inventory.models import Reservation
-from inventory.services import audit_log
+from inventory.feed import compact_stock_changes
+from inventory.services import reconcile_stock, release_reservation
 
 
 @shared_task
+@use_primary()
 def cleanup_expired_reservations():
-    expired_reservations = Reservation.objects.filter(
-        expires_at__lt=timezone.now(),
-        order__isnull=True   
-    ).select_related('product')
+    expired_reservations = Reservation.objects.expired()
 
     cleaned_count = 0
     for reservation in expired_reservations:
-        product = reservation.product
-        with transaction.atomic():
-            product.available_stock += reservation.quantity
-            product.reserved_stock -= reservation.quantity
-            product.save()
-
-            audit_log(
-                action='reservation_expired',
-                object_type='Reservation',
-                object_id=str(reservation.pk),
-                old_value={'quantity': reservation.quantity, 'product': str(product.pk)},
-                new_value=None,
-                actor=None
-            )
-            reservation.delete()
+        try:
+            released = release_reservation(reservation)
+        except RetriesExhausted:
+            # still expired and active, the next sweep picks it up
+            continue
+        if released:
             cleaned_count += 1
 
-    return cleaned_count
\ No newline at end of file
+    return cleaned_count
+
+
+@shared_task
+@use_primary()
+def reconcile_stock_levels(repair=False):
+    return reconcile_stock(repair=repair)
+
+
+@shared_task
+@use_primary()
+def compact_stock_change_feed():
+    return compact_stock_changes()
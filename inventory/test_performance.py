@@ -0,0 +1,200 @@
+from datetime import timedelta
+from io import StringIO
+import itertools
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.test import APITestCase
+
+from .models import Order, Product, Reservation
+from .services import reconcile_stock
+from .tasks import cleanup_expired_reservations
+from .views import OrderViewSet, ProductViewSet
+
+
+# deliberately unindexed (see Product.Meta): lists that only filter or sort by them may scan
+UNINDEXED_PRODUCT_COLUMNS = {'available_stock', 'reserved_stock'}
+
+
+def filter_combinations(viewset, row):
+    """
+    Every combination of the viewset's FilterSet filters, named by their
+    query parameters. The values are taken from `row`, so each combination
+    matches at least that row.
+    """
+    filterset = DjangoFilterBackend().get_filterset_class(viewset(), viewset.queryset)
+    params = {}
+    for name, field in filterset.base_filters.items():
+        value = getattr(row, field.field_name)
+        params[name] = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return {
+        '+'.join(names) or 'none': {name: params[name] for name in names}
+        for size in range(len(params) + 1)
+        for names in itertools.combinations(params, size)
+    }
+
+
+def orderings(viewset):
+    return [prefix + field for field in viewset.ordering_fields for prefix in ('', '-')]
+
+
+def index_name(model, fields):
+    for index in model._meta.indexes:
+        if list(index.fields) == fields:
+            return index.name
+    raise AssertionError(f'{model.__name__} has no index on {fields}')
+
+
+class QueryPlanMixin:
+    """EXPLAIN QUERY PLAN helpers for the SQL captured from real requests."""
+
+    big_tables = ('inventory_order', 'inventory_orderitem', 'inventory_product', 'inventory_reservation')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertIndexedPlans(self, queries):
+        """
+        No full table scans, and no sort of a whole table: a temp b-tree is
+        only accepted on rows an index SEARCH has already narrowed down.
+        """
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = self.explain(sql)
+            for step in plan:
+                # a bare "SCAN <table>" is a full table scan
+                self.assertNotIn(step, [f'SCAN {table}' for table in self.big_tables], f'{sql}\n{plan}')
+            if 'USE TEMP B-TREE FOR ORDER BY' in plan:
+                self.assertTrue(any(step.startswith('SEARCH') for step in plan), f'{sql}\n{plan}')
+
+    def assertUsesIndex(self, queries, index):
+        plans = [step for query in queries if query['sql'].startswith('SELECT') for step in self.explain(query['sql'])]
+        self.assertTrue(any(f'INDEX {index}' in step for step in plans), plans)
+
+
+class ListQueryRegressionTest(QueryPlanMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_dataset', preset='tiny', seed=1, stdout=StringIO())
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, ctx.captured_queries
+
+    def test_order_list_combinations(self):
+        row = Order.objects.filter(status='delivered').first()
+        combinations = itertools.product(filter_combinations(OrderViewSet, row).items(), orderings(OrderViewSet))
+        for (name, filters), ordering in combinations:
+            with self.subTest(filters=name, ordering=ordering):
+                response, queries = self.get('/api/orders/', {**filters, 'ordering': ordering})
+                self.assertTrue(response.data['results'])
+                # fingerprint (also the page count), page, items, products
+                self.assertEqual(len(queries), 4)
+                self.assertIndexedPlans(queries)
+
+                response, queries = self.get('/api/orders/', {**filters, 'ordering': ordering, 'fields': 'uuid,status,total'})
+                self.assertEqual(len(queries), 2)
+                self.assertIndexedPlans(queries)
+
+    def test_product_list_combinations(self):
+        row = Product.objects.filter(reserved_stock__gt=0).first()
+        combinations = itertools.product(filter_combinations(ProductViewSet, row).items(), orderings(ProductViewSet))
+        for (name, filters), ordering in combinations:
+            with self.subTest(filters=name, ordering=ordering):
+                response, queries = self.get('/api/products/', {**filters, 'ordering': ordering})
+                self.assertTrue(response.data['results'])
+                self.assertEqual(len(queries), 2)
+                filtered = {param.split('__')[0] for param in filters}
+                # no indexed filter narrows down a filter or sort on a stock count
+                if filtered <= UNINDEXED_PRODUCT_COLUMNS and (filtered | {ordering.lstrip('-')}) & UNINDEXED_PRODUCT_COLUMNS:
+                    continue
+                self.assertIndexedPlans(queries)
+
+    def test_intended_indexes(self):
+        _, queries = self.get('/api/orders/', {'status': 'delivered'})
+        self.assertUsesIndex(queries, index_name(Order, ['status', 'created_at']))
+        _, queries = self.get('/api/orders/', {'status': 'delivered', 'ordering': '-total'})
+        self.assertUsesIndex(queries, index_name(Order, ['status', 'total']))
+        _, queries = self.get('/api/orders/', {'created_at__gte': timezone.now().isoformat()})
+        self.assertUsesIndex(queries, index_name(Order, ['created_at', 'total']))
+        _, queries = self.get('/api/products/', {'ordering': 'name'})
+        self.assertUsesIndex(queries, index_name(Product, ['name']))
+
+    def test_held_stock_queries_use_active_indexes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            reconcile_stock(incremental=False)
+        self.assertUsesIndex(ctx.captured_queries, 'reservation_active_product_idx')
+        with CaptureQueriesContext(connection) as ctx:
+            list(Reservation.objects.expired())
+        self.assertUsesIndex(ctx.captured_queries, 'reservation_active_expiry_idx')
+
+    def test_not_modified_skips_page_queries(self):
+        response, _ = self.get('/api/orders/', {})
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class WritePathQueryRegressionTest(QueryPlanMixin, APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test', total_stock=10, available_stock=10, reserved_stock=0)
+
+    def test_reservation_create(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        # savepoint, warehouse stock lookup, product update, feed insert, reservation insert, audit insert, release
+        self.assertEqual(statements, ['SAVEPOINT', 'SELECT', 'UPDATE', 'INSERT', 'INSERT', 'INSERT', 'RELEASE'])
+        self.assertIndexedPlans(ctx.captured_queries)
+
+    def test_order_transition(self):
+        user = User.objects.create_user('buyer')
+        order = Order.objects.create(user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/orders/{order.pk}/confirm/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        # order lookup, then savepoint, compare-and-swap update, audit insert, release: no row lock
+        self.assertEqual(statements, ['SELECT', 'SAVEPOINT', 'UPDATE', 'INSERT', 'RELEASE'])
+        self.assertNotIn('FOR UPDATE', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+    def test_cleanup_sweep(self):
+        for _ in range(3):
+            self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 1})
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(cleanup_expired_reservations(), 3)
+        # one select, then per reservation: savepoint, claim, stock update, feed insert, audit insert, release
+        self.assertEqual(len(ctx.captured_queries), 1 + 3 * 6)
+        self.assertUsesIndex(ctx.captured_queries[:1], 'reservation_active_expiry_idx')
+
+    def test_bulk_release(self):
+        other = Product.objects.create(name='Other', total_stock=10, available_stock=10, reserved_stock=0)
+        self.client.force_authenticate(User.objects.create_user('buyer'))
+        ids = [
+            self.client.post('/api/reservations/', {'product': str(product.pk), 'quantity': 1}).data['uuid']
+            for product in [self.product, other] * 5
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/reservations/release/', {'reservations': ids}, format='json')
+        self.assertEqual(len(response.data['released']), 10)
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        # savepoint, claim, claimed rows, one stock update per product, feed insert, audit insert, release
+        self.assertEqual(
+            statements,
+            ['SAVEPOINT', 'UPDATE', 'SELECT', 'UPDATE', 'UPDATE', 'INSERT', 'INSERT', 'RELEASE'],
+        )
+
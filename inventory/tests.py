@@ -1,13 +1,43 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from unittest.mock import patch
+from django.db import OperationalError, connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.core.exceptions import ValidationError
-from .models import Product, Reservation, Order
-from inventory.services import transition_order
-from django.core.management import call_command
+from .models import (
+    DEFAULT_WAREHOUSE_CODE, AuditLog, Order, OrderItem, Product, Reservation, ReservationStatus, StockChange, Warehouse,
+    WarehouseStock,
+)
+from inventory.services import (
+    TransitionConflict, adjust_warehouse_stock, reconcile_stock, transition_order,
+)
+from inventory.feed import ChangeNotifier, changes_since, compact_stock_changes
+from core.db_router import pin_primary, sync_sqlite_database, unpin, use_primary
+from core.metrics import registry as metrics_registry
+from core.middleware import ReplicaPinMiddleware
+from inventory.views import MAX_BULK_RELEASE, OrderViewSet
+from inventory import reservation_store
+from inventory.tasks import cleanup_expired_reservations
+from inventory.management.commands import benchmark, generate_dataset
+from core.retry import RetriesExhausted, RetryBudget, RetryPolicy, finish_request_retries, start_request_retries
+from django.core.management import CommandError, call_command
+from io import StringIO
 
 
 class ProductModelTest(TestCase):
@@ -80,6 +110,19 @@ class OrderStateMachineTest(TestCase):
         transition_order(order=order2, new_status='cancelled', actor=self.user)
         self.assertEqual(order2.status, 'cancelled')
 
+    def test_concurrent_transition_conflicts(self):
+        first = Order.objects.get(pk=self.order.pk)
+        second = Order.objects.get(pk=self.order.pk)
+        transition_order(order=first, new_status='confirmed', actor=self.user)
+
+        with self.assertRaises(TransitionConflict) as ctx:
+            transition_order(order=second, new_status='cancelled', actor=self.user)
+        self.assertEqual(ctx.exception.current_status, 'confirmed')
+        self.assertEqual(second.status, 'pending')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'confirmed')
+        self.assertEqual(AuditLog.objects.filter(action='status_changed').count(), 1)
+
 class ReservationAPITest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user('test', 'test@test.com', 'pass')
@@ -98,6 +141,98 @@ class ReservationAPITest(APITestCase):
         response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 15})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+class ReservationReleaseAPITest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.com', 'pass')
+        self.product = Product.objects.create(name='Test', total_stock=10, available_stock=10, reserved_stock=0)
+        self.client.force_authenticate(user=self.user)
+
+    def reserve(self, product, quantity):
+        response = self.client.post('/api/reservations/', {'product': str(product.pk), 'quantity': quantity})
+        return response.data['uuid']
+
+    def test_delete_returns_stock_immediately(self):
+        reservation_id = self.reserve(self.product, 3)
+        response = self.client.delete(f'/api/reservations/{reservation_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (10, 0))
+        reservation = Reservation.objects.all_objects().get(pk=reservation_id)
+        self.assertEqual(reservation.status, ReservationStatus.RELEASED)
+        entry = AuditLog.objects.get(action='reservation_released')
+        self.assertEqual(entry.actor, self.user)
+        self.assertEqual(entry.object_id, str(reservation_id))
+
+        # a second release, or the sweep, must not return the stock twice
+        response = self.client.delete(f'/api/reservations/{reservation_id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(cleanup_expired_reservations(), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 10)
+
+    def test_delete_unknown_reservation(self):
+        self.assertEqual(self.client.delete('/api/reservations/not-a-uuid/').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete('/api/reservations/00000000-0000-0000-0000-000000000000/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_release(self):
+        other = Product.objects.create(name='Other', total_stock=5, available_stock=5, reserved_stock=0)
+        ids = [self.reserve(self.product, 2), self.reserve(self.product, 1), self.reserve(other, 4)]
+        kept = self.reserve(self.product, 1)
+        missing = '00000000-0000-0000-0000-000000000000'
+
+        response = self.client.post('/api/reservations/release/', {'reservations': ids + [missing]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['released'], ids)
+        self.assertEqual(response.data['not_released'], [missing])
+
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (9, 1))
+        self.assertEqual((other.available_stock, other.reserved_stock), (5, 0))
+        self.assertEqual(AuditLog.objects.filter(action='reservation_released').count(), 3)
+        self.assertTrue(Reservation.objects.active().filter(pk=kept).exists())
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+    def test_bulk_release_validation(self):
+        for payload in ({}, {'reservations': []}, {'reservations': 'abc'}, {'reservations': ['abc']}):
+            response = self.client.post('/api/reservations/release/', payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, payload)
+        too_many = [str(uuid.uuid4()) for _ in range(MAX_BULK_RELEASE + 1)]
+        response = self.client.post('/api/reservations/release/', {'reservations': too_many}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_warehouse_stock_is_returned(self):
+        product = Product.objects.create(name='Stocked', total_stock=0, available_stock=0, reserved_stock=0)
+        warehouse = Warehouse.objects.create(name='Main', code='MAIN')
+        adjust_warehouse_stock(product=product, warehouse=warehouse, delta=10, actor=None)
+        reservation_id = self.reserve(product, 4)
+        self.client.delete(f'/api/reservations/{reservation_id}/')
+        stock = WarehouseStock.objects.get(product=product, warehouse=warehouse)
+        self.assertEqual((stock.available_stock, stock.reserved_stock), (10, 0))
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+    def test_only_the_owner_can_release(self):
+        reservation_id = self.reserve(self.product, 3)
+        self.assertEqual(Reservation.objects.get(pk=reservation_id).user, self.user)
+
+        self.client.force_authenticate(user=User.objects.create_user('other'))
+        response = self.client.delete(f'/api/reservations/{reservation_id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post('/api/reservations/release/', {'reservations': [reservation_id]}, format='json')
+        self.assertEqual((response.data['released'], response.data['not_released']), ([], [reservation_id]))
+
+        self.client.force_authenticate(user=None)
+        response = self.client.delete(f'/api/reservations/{reservation_id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post('/api/reservations/release/', {'reservations': [reservation_id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_stock, self.product.reserved_stock), (7, 3))
+        self.assertTrue(Reservation.objects.active().filter(pk=reservation_id).exists())
+
+
 class OrderAPITest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user('test', 'test@test.com', 'pass')
@@ -122,6 +257,15 @@ class OrderAPITest(APITestCase):
         response = self.client.post(f'/api/orders/{self.order.pk}/cancel/')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_lost_race_returns_conflict(self):
+        # another request cancels the order after this one has loaded it
+        stale = Order.objects.get(pk=self.order.pk)
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        with patch.object(OrderViewSet, 'get_object', return_value=stale):
+            response = self.client.post(f'/api/orders/{self.order.pk}/confirm/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['status'], 'cancelled')
+
 class CleanupCommandTest(TestCase):
     def setUp(self):
         self.product = Product.objects.create(name='Test', total_stock=10, available_stock=10, reserved_stock=0)
@@ -140,3 +284,774 @@ class CleanupCommandTest(TestCase):
         self.assertEqual(self.product.available_stock, 10)
         self.assertEqual(self.product.reserved_stock, 0)
         self.assertEqual(Reservation.objects.count(), 0)
+        reservation = Reservation.objects.all_objects().get()
+        self.assertEqual(reservation.status, ReservationStatus.EXPIRED)
+        self.assertTrue(reservation.is_expired())
+
+    def test_cleanup_skips_finished_reservations(self):
+        # a hold that was already released must not return its stock twice
+        Reservation.objects.create(
+            product=self.product,
+            quantity=2,
+            expires_at=timezone.now() - timedelta(minutes=1),
+            status=ReservationStatus.RELEASED,
+        )
+        call_command('cleanup_reservations', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 10)
+        self.assertFalse(Reservation.objects.expired().exists())
+
+
+class ConditionalListTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.com', 'pass')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Test', total_stock=10, available_stock=10, reserved_stock=0)
+        self.order = Order.objects.create(user=self.user)
+
+    def test_products_not_modified(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_products_etag_changes_after_reservation(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 1})
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_orders_etag_changes_after_transition(self):
+        response = self.client.get('/api/orders/?status=pending')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertNotEqual(etag, self.client.get('/api/orders/?status=confirmed')['ETag'])
+
+        transition_order(order=self.order, new_status='confirmed', actor=self.user)
+        response = self.client.get('/api/orders/?status=pending', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_soft_delete_is_not_hidden_by_if_modified_since(self):
+        Order.objects.create(user=self.user)
+        response = self.client.get('/api/orders/')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        # max(updated_at) of the remaining rows doesn't move
+        self.order.delete()
+        response = self.client.get('/api/orders/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Last-Modified'], last_modified)
+        response = self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class StockReconciliationTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Test', total_stock=10, available_stock=8, reserved_stock=2)
+        Reservation.objects.create(product=self.product, quantity=2, expires_at=timezone.now() + timedelta(minutes=10))
+
+    def test_consistent_stock(self):
+        result = reconcile_stock(incremental=False)
+        self.assertEqual(result['checked'], 1)
+        self.assertEqual(result['mismatched'], 0)
+
+    def test_detect_and_repair_drift(self):
+        # queryset updates bypass Product.save()
+        Product.objects.filter(pk=self.product.pk).update(reserved_stock=5, available_stock=5)
+        result = reconcile_stock(incremental=False)
+        self.assertEqual(result['mismatched'], 1)
+        self.assertEqual(result['repaired'], 0)
+
+        result = reconcile_stock(incremental=False, repair=True)
+        self.assertEqual(result['repaired'], 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 2)
+        self.assertEqual(self.product.available_stock, 8)
+        self.assertTrue(AuditLog.objects.filter(action='stock_repaired', object_id=str(self.product.pk)).exists())
+
+    def test_incremental_from_watermark(self):
+        reconcile_stock()
+        self.assertEqual(reconcile_stock()['checked'], 0)
+
+        Reservation.objects.create(product=self.product, quantity=1, expires_at=timezone.now() + timedelta(minutes=10))
+        result = reconcile_stock()
+        self.assertEqual(result['checked'], 1)
+        self.assertEqual(result['mismatched'], 1)
+
+
+class WarehouseAllocationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.com', 'pass')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Test', total_stock=0, available_stock=0, reserved_stock=0)
+        self.east = Warehouse.objects.create(name='East', code='east')
+        self.west = Warehouse.objects.create(name='West', code='west')
+        adjust_warehouse_stock(product=self.product, warehouse=self.east, delta=3, actor=self.user)
+        adjust_warehouse_stock(product=self.product, warehouse=self.west, delta=5, actor=self.user)
+
+    def stock(self, warehouse):
+        return WarehouseStock.objects.get(product=self.product, warehouse=warehouse)
+
+    def test_product_totals_follow_warehouses(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.total_stock, 8)
+        self.assertEqual(self.product.available_stock, 8)
+
+    def test_preferred_warehouse(self):
+        response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 2, 'warehouses': ['east']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['warehouse'], self.east.pk)
+        self.assertEqual(self.stock(self.east).available_stock, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 2)
+
+    def test_fallback_when_preferred_short(self):
+        response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 4, 'warehouses': ['east']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['warehouse'], self.west.pk)
+
+    def test_split_across_warehouses(self):
+        response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 7, 'allow_split': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(r['quantity'] for r in response.data['reservations']), [2, 5])
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+    def test_response_shape_follows_the_request(self):
+        single = Product.objects.create(name='Single', total_stock=5, available_stock=5)
+        for product in (self.product, single):
+            response = self.client.post('/api/reservations/', {'product': str(product.pk), 'quantity': 1}, format='json')
+            self.assertEqual(response.data['product'], str(product.pk))
+            response = self.client.post(
+                '/api/reservations/', {'product': str(product.pk), 'quantity': 1, 'allow_split': True}, format='json',
+            )
+            self.assertEqual([r['quantity'] for r in response.data['reservations']], [1])
+
+    def test_existing_stock_moves_to_the_default_warehouse(self):
+        product = Product.objects.create(name='Legacy', total_stock=10, available_stock=10)
+        self.client.post('/api/reservations/', {'product': str(product.pk), 'quantity': 4})
+
+        adjust_warehouse_stock(product=product, warehouse=self.east, delta=2, actor=self.user)
+        default = WarehouseStock.objects.get(product=product, warehouse__code=DEFAULT_WAREHOUSE_CODE)
+        self.assertEqual((default.total_stock, default.available_stock, default.reserved_stock), (10, 6, 4))
+        self.assertEqual(Reservation.objects.active().get(product=product).warehouse, default.warehouse)
+        product.refresh_from_db()
+        self.assertEqual(product.total_stock, 12)
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+        # the moved reservation returns its units to the default warehouse
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        cleanup_expired_reservations()
+        default.refresh_from_db()
+        self.assertEqual((default.available_stock, default.reserved_stock), (10, 0))
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+    def test_cleanup_releases_warehouse_stock(self):
+        self.client.post('/api/reservations/', {'product': str(self.product.pk), 'quantity': 2, 'warehouses': ['east']}, format='json')
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('cleanup_reservations')
+        self.assertEqual(self.stock(self.east).available_stock, 3)
+        self.assertEqual(self.stock(self.east).reserved_stock, 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 8)
+
+
+class ProductSearchTest(APITestCase):
+    def setUp(self):
+        for name in ['Laptop Pro', 'Laptop Air', 'Gaming Laptop', 'Mouse', 'Lamp']:
+            Product.objects.create(name=name, total_stock=1, available_stock=1, reserved_stock=0)
+
+    def search(self, **params):
+        response = self.client.get('/api/products/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_prefix_search(self):
+        names = {p['name'] for p in self.search(q='lap')['results']}
+        self.assertEqual(names, {'Laptop Pro', 'Laptop Air', 'Gaming Laptop'})
+        names = {p['name'] for p in self.search(q='laptop pr')['results']}
+        self.assertEqual(names, {'Laptop Pro'})
+
+    def test_index_follows_writes(self):
+        product = Product.objects.get(name='Mouse')
+        Product.objects.filter(pk=product.pk).update(name='Trackball')
+        self.assertEqual(self.search(q='mouse')['results'], [])
+        self.assertEqual(len(self.search(q='track')['results']), 1)
+
+        product.refresh_from_db()
+        product.delete()
+        self.assertEqual(self.search(q='track')['results'], [])
+
+    def test_keyset_pagination(self):
+        first = self.search(q='laptop', limit=2)
+        self.assertEqual(len(first['results']), 2)
+        second = self.search(q='laptop', limit=2, cursor=first['next_cursor'])
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next_cursor'])
+        seen = {p['uuid'] for p in first['results'] + second['results']}
+        self.assertEqual(len(seen), 3)
+
+    def test_rebuild_command(self):
+        call_command('rebuild_product_search', stdout=StringIO())
+        self.assertEqual(len(self.search(q='lamp')['results']), 1)
+
+    def test_index_survives_renumbered_rowids(self):
+        # VACUUM may renumber the implicit rowids of a table with a UUID pk
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE inventory_product SET rowid = -rowid')
+        self.assertEqual([p['name'] for p in self.search(q='lamp')['results']], ['Lamp'])
+        Product.objects.filter(name='Lamp').update(name='Desk Light')
+        self.assertEqual(self.search(q='lamp')['results'], [])
+        self.assertEqual([p['name'] for p in self.search(q='desk')['results']], ['Desk Light'])
+
+    def test_tampered_cursor(self):
+        for values in ({'a': 1}, [1], ['a', 1], [1.5, 'a'], [True, 1], [1, 2, 3]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            response = self.client.get('/api/products/search/', {'q': 'laptop', 'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, values)
+        response = self.client.get('/api/products/search/', {'q': 'laptop', 'cursor': '!!'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(len(self.search(q='"lap*')['results']), 3)
+        self.assertEqual(self.search(q='"(')['results'], [])
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@test.com', 'pass')
+        self.client.force_authenticate(user=self.user)
+        product = Product.objects.create(name='Test', total_stock=10, available_stock=10, reserved_stock=0)
+        for _ in range(3):
+            order = Order.objects.create(user=self.user, total=10)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=10)
+
+    def test_full_representation_by_default(self):
+        with self.assertNumQueries(4):  # fingerprint (and count), orders, items, products
+            response = self.client.get('/api/orders/')
+        self.assertIn('items', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['items'][0]['product_name'], 'Test')
+
+    def test_sparse_fields_skip_prefetch(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/?fields=uuid,status,total')
+        self.assertEqual(set(response.data['results'][0]), {'uuid', 'status', 'total'})
+
+    def test_expand_items(self):
+        response = self.client.get('/api/orders/?fields=uuid,status&expand=items')
+        self.assertEqual(set(response.data['results'][0]), {'uuid', 'status', 'items'})
+        self.assertEqual(len(response.data['results'][0]['items']), 1)
+
+    def test_product_fields(self):
+        response = self.client.get('/api/products/?fields=uuid,available_stock')
+        self.assertEqual(set(response.data['results'][0]), {'uuid', 'available_stock'})
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/orders/?fields=uuid,secret')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post('/api/products/?fields=uuid', {'name': 'Posted', 'total_stock': 4, 'available_stock': 4})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_stock'], 4)
+
+        product = Product.objects.get(name='Test')
+        response = self.client.patch(
+            f'/api/products/{product.pk}/?fields=name', {'name': 'Renamed', 'total_stock': 12, 'available_stock': 12},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.total_stock, product.available_stock), ('Renamed', 12, 12))
+
+
+class RendererTest(TestCase):
+    def test_matches_stdlib_output(self):
+        from rest_framework.renderers import JSONRenderer
+        from core.renderers import RequestIDJSONRenderer
+
+        data = {
+            'uuid': uuid.uuid4(),
+            'total': Decimal('12.50'),
+            'created_at': timezone.now(),
+            'name': 'caf\u00e9 \u2028',
+            'items': [{'quantity': 1}],
+        }
+        expected = json.loads(JSONRenderer().render(dict(data)))
+        rendered = RequestIDJSONRenderer().render(data, renderer_context={})
+        self.assertEqual(json.loads(rendered), expected)
+        self.assertNotIn(b'\xe2\x80\xa8', rendered)
+
+
+class GZipTest(APITestCase):
+    def setUp(self):
+        for i in range(30):
+            Product.objects.create(name=f'Product {i}', total_stock=10, available_stock=10, reserved_stock=0)
+
+    def test_large_response_compressed(self):
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('request_id', json.loads(gzip.decompress(response.content)))
+
+    def test_small_response_not_compressed(self):
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class StartupImportTest(TestCase):
+    def test_web_worker_skips_dev_and_celery_modules(self):
+        out = StringIO()
+        call_command('profile_imports', top=0, stdout=out)
+        self.assertIn('cold start', out.getvalue())
+
+
+class GenerateDatasetTest(APITestCase):
+    def test_generate_tiny_dataset(self):
+        call_command('generate_dataset', preset='tiny', products=300, orders=200, stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 300)
+        self.assertEqual(Order.objects.count(), 200)
+        self.assertTrue(OrderItem.objects.exists())
+        self.assertTrue(Reservation.objects.filter(expires_at__lt=timezone.now()).exists())
+        self.assertTrue(Reservation.objects.dead().exists())
+        # dates are spread over the history window, not stamped with "now"
+        self.assertLess(Order.objects.order_by('created_at').first().created_at, timezone.now() - timedelta(days=1))
+        self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+
+    def test_populate_endpoint_with_preset(self):
+        response = self.client.post('/populate/?size=tiny')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Product.objects.count(), 200)
+
+        response = self.client.post('/populate/?size=huge')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/populate/?size=large')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/populate/?size=tiny', {'seed': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reused_seed_is_rejected(self):
+        response = self.client.post('/populate/?size=tiny')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post('/populate/?size=tiny')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('seed 42', response.data['error'])
+        self.assertEqual(Product.objects.count(), 200)
+
+        response = self.client.post('/populate/?size=tiny', {'seed': 43})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Product.objects.count(), 400)
+
+    def test_generation_leaves_auto_timestamps_alone(self):
+        fields = [Product._meta.get_field('created_at'), Product._meta.get_field('updated_at')]
+
+        def insert(model, rows, batch_size):
+            # rows written by other threads meanwhile still get "now"
+            self.assertEqual([(f.auto_now_add, f.auto_now) for f in fields], [(True, False), (False, True)])
+            original(model, rows, batch_size)
+
+        original = generate_dataset.insert_rows
+        with patch.object(generate_dataset, 'insert_rows', insert):
+            call_command('generate_dataset', preset='tiny', products=10, orders=10, stdout=StringIO())
+        self.assertLess(Product.objects.order_by('created_at').first().created_at, timezone.now() - timedelta(days=1))
+        log = AuditLog.objects.order_by('timestamp').first()
+        self.assertLess(log.timestamp, timezone.now() - timedelta(minutes=5))
+        self.assertEqual(log.created_at, log.timestamp)
+
+
+class MetricsTest(APITestCase):
+    def sample(self, name):
+        body = self.client.get('/metrics/').content.decode()
+        for line in body.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    @override_settings(METRICS_STOCK_TOTALS_TTL=0)
+    def test_reservation_outcomes_and_gauges(self):
+        product = Product.objects.create(name='Metered', total_stock=5, available_stock=5)
+        created = self.sample('inventory_reservations_total{outcome="created"}')
+        rejected = self.sample('inventory_reservations_total{outcome="insufficient_stock"}')
+
+        self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': 3})
+        self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': 3})
+
+        response = self.client.get('/metrics/')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertEqual(self.sample('inventory_reservations_total{outcome="created"}'), created + 1)
+        self.assertEqual(self.sample('inventory_reservations_total{outcome="insufficient_stock"}'), rejected + 1)
+        self.assertEqual(self.sample('inventory_reserved_stock'), 3)
+        self.assertEqual(self.sample('inventory_oldest_expired_reservation_seconds'), 0)
+
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=2))
+        self.assertGreaterEqual(self.sample('inventory_oldest_expired_reservation_seconds'), 120)
+
+    def test_rejections_are_labelled_by_cause(self):
+        outcomes = ('insufficient_stock', 'not_found', 'invalid')
+        before = {outcome: self.sample(f'inventory_reservations_total{{outcome="{outcome}"}}') for outcome in outcomes}
+        self.client.post('/api/reservations/', {'product': str(uuid.uuid4()), 'quantity': 1})
+        self.client.post('/api/reservations/', {'product': 'not-a-uuid', 'quantity': 1})
+        after = {outcome: self.sample(f'inventory_reservations_total{{outcome="{outcome}"}}') for outcome in outcomes}
+        self.assertEqual(
+            {outcome: after[outcome] - before[outcome] for outcome in outcomes},
+            {'insufficient_stock': 0, 'not_found': 1, 'invalid': 1},
+        )
+
+    def test_aggregates_other_worker_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.sample('inventory_reservations_total{outcome="created"}')
+            with open(os.path.join(directory, 'metrics_1_0.json'), 'w') as fh:
+                json.dump({'inventory_reservations_total': [[['created'], 7]]}, fh)
+            self.assertEqual(self.sample('inventory_reservations_total{outcome="created"}'), before + 7)
+            self.assertTrue(any(name.startswith(f'metrics_{os.getpid()}_') for name in os.listdir(directory)))
+
+    def test_exited_worker_files_are_folded_into_the_archive(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.sample('inventory_reservations_total{outcome="created"}')
+            for start in (0, 1):
+                with open(os.path.join(directory, f'metrics_{exited.pid}_{start}.json'), 'w') as fh:
+                    json.dump({'inventory_reservations_total': [[['created'], 7]]}, fh)
+
+            self.assertEqual(self.sample('inventory_reservations_total{outcome="created"}'), before + 14)
+            self.assertFalse(any(name.startswith(f'metrics_{exited.pid}_') for name in os.listdir(directory)))
+            self.assertIn('metrics_archive.json', os.listdir(directory))
+            # counters don't go backwards once the files are gone
+            self.assertEqual(self.sample('inventory_reservations_total{outcome="created"}'), before + 14)
+
+
+    def test_stock_totals_are_cached_between_scrapes(self):
+        Product.objects.create(name='Held', total_stock=5, available_stock=3, reserved_stock=2)
+        with override_settings(METRICS_STOCK_TOTALS_TTL=0):
+            self.assertEqual(self.sample('inventory_reserved_stock'), 2)
+        Product.objects.create(name='Also held', total_stock=5, available_stock=4, reserved_stock=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sample('inventory_reserved_stock'), 2)
+        self.assertFalse([q for q in queries.captured_queries if 'SUM(' in q['sql']])
+
+    def test_concurrent_flushes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            errors = []
+
+            def flush():
+                try:
+                    for _ in range(50):
+                        metrics_registry.flush()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=flush) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual([name for name in os.listdir(directory) if name.endswith('.tmp')], [])
+
+    def test_failed_flush_does_not_fail_the_write(self):
+        product = Product.objects.create(name='Metered', total_stock=5, available_stock=5)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            metrics_registry._last_flush = 0.0
+            with patch('core.metrics._write_json', side_effect=FileNotFoundError), self.assertLogs('metrics', 'WARNING'):
+                response = self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class StockChangeFeedTest(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Fed', total_stock=10, available_stock=10)
+        self.other = Product.objects.create(name='Other', total_stock=5, available_stock=5)
+
+    def reserve(self, product, quantity=1):
+        response = self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': quantity})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_long_poll_coalesces_changes_per_product(self):
+        start = self.client.get('/api/stock-changes/').data['next']
+        self.reserve(self.product)
+        self.reserve(self.other)
+        self.reserve(self.product, 2)
+
+        response = self.client.get('/api/stock-changes/', {'since': start, 'timeout': 0})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changes = response.data['changes']
+        # ordered by last change, one entry per product with current counters
+        self.assertEqual([c['product'] for c in changes], [str(self.other.pk), str(self.product.pk)])
+        self.assertEqual(changes[1]['available_stock'], 7)
+        self.assertEqual(changes[1]['reserved_stock'], 3)
+        self.assertEqual(response.data['next'], changes[1]['seq'])
+
+        response = self.client.get('/api/stock-changes/', {'since': response.data['next'], 'timeout': 0})
+        self.assertEqual(response.data['changes'], [])
+
+    def test_records_every_stock_mutation(self):
+        warehouse = Warehouse.objects.create(name='Main', code='MAIN')
+        adjust_warehouse_stock(product=self.other, warehouse=warehouse, delta=5, actor=None)
+        self.reserve(self.product)
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('cleanup_reservations', stdout=StringIO())
+
+        self.assertEqual(
+            list(StockChange.objects.order_by('seq').values_list('reason', flat=True)),
+            ['stock_adjusted', 'reservation_created', 'reservation_expired'],
+        )
+        changes, _ = changes_since(0)
+        self.assertEqual(changes[-1]['available_stock'], 10)
+
+    def test_compaction_keeps_feed_result(self):
+        for _ in range(3):
+            self.reserve(self.product)
+        self.reserve(self.other)
+        before = changes_since(0)
+        StockChange.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(compact_stock_changes(), 2)
+        self.assertEqual(changes_since(0), before)
+        self.assertEqual(StockChange.objects.count(), 2)
+
+    def test_event_stream(self):
+        start = self.client.get('/api/stock-changes/').data['next']
+        self.reserve(self.product)
+
+        response = self.client.get('/api/stock-changes/stream/', HTTP_LAST_EVENT_ID=str(start))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b'retry: 1000\n\n')
+        event = next(chunks).decode()
+        response.close()
+        self.assertTrue(event.startswith('id: '))
+        self.assertIn('event: stock', event)
+        self.assertEqual(json.loads(event.split('data: ')[1])['reserved_stock'], 1)
+
+    def test_waiters_are_capped_per_process(self):
+        start = self.client.get('/api/stock-changes/').data['next']
+        with override_settings(STOCK_FEED_MAX_WAITERS=1):
+            stream = self.client.get('/api/stock-changes/stream/', {'since': start})
+            next(iter(stream.streaming_content))
+            response = self.client.get('/api/stock-changes/', {'since': start, 'timeout': 0})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            # closing the stream gives its slot back
+            stream.close()
+            response = self.client.get('/api/stock-changes/', {'since': start, 'timeout': 0})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_since(self):
+        response = self.client.get('/api/stock-changes/', {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/stock-changes/stream/', {'since': '-1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChangeNotifierTest(TestCase):
+    def setUp(self):
+        self.sequence = 5
+        self.reads = 0
+        self.notifier = ChangeNotifier(latest=self.read, poll_interval=60)
+
+    def read(self):
+        self.reads += 1
+        return self.sequence
+
+    def test_waiters_share_one_poller(self):
+        self.assertTrue(self.notifier.wait(4, timeout=1))
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(self.notifier.wait(5, timeout=5))) for _ in range(10)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.1)
+        reads = self.reads
+        # a writer commits: one read wakes every waiter
+        self.sequence = 6
+        self.notifier.poke()
+        for waiter in waiters:
+            waiter.join()
+        self.assertEqual(results, [True] * 10)
+        self.assertLessEqual(self.reads - reads, 2)
+
+    def test_times_out_without_changes(self):
+        started = time.monotonic()
+        self.assertFalse(self.notifier.wait(5, timeout=0.2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TransactionTestCase):
+    def test_reads_go_to_replica_writes_to_primary(self):
+        token = pin_primary(False)
+        try:
+            self.assertEqual(Product.objects.all().db, 'replica')
+            self.assertEqual(Product.objects.select_for_update().db, 'default')
+            self.assertEqual(router.db_for_write(Product), 'default')
+        finally:
+            unpin(token)
+
+    def test_primary_reads_unless_opted_in(self):
+        # tasks, commands and threads never opted in
+        self.assertEqual(Product.objects.all().db, 'default')
+        token = pin_primary(False)
+        try:
+            with use_primary():
+                self.assertEqual(Product.objects.all().db, 'default')
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, 'default')
+            self.assertEqual(Product.objects.all().db, 'replica')
+        finally:
+            unpin(token)
+
+    def test_jobs_read_their_own_writes(self):
+        # the `replica` alias isn't configured here: any read routed to it fails
+        token = pin_primary(False)
+        try:
+            call_command('generate_dataset', preset='tiny', seed=5, stdout=StringIO())
+            self.assertEqual(reconcile_stock(incremental=False)['mismatched'], 0)
+        finally:
+            unpin(token)
+
+    def test_read_your_writes_cookie(self):
+        seen = []
+        middleware = ReplicaPinMiddleware(lambda request: seen.append(router.db_for_read(Product)) or HttpResponse())
+        factory = RequestFactory()
+
+        response = middleware(factory.post('/api/reservations/'))
+        self.assertIn(ReplicaPinMiddleware.COOKIE_NAME, response.cookies)
+        middleware(factory.get('/api/products/'))
+        request = factory.get('/api/products/')
+        request.COOKIES[ReplicaPinMiddleware.COOKIE_NAME] = '1'
+        middleware(request)
+        middleware(factory.put('/api/products/'))
+        self.assertEqual(seen, ['default', 'replica', 'default', 'default'])
+        # the opt-in doesn't leak out of the request
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_sync_sqlite_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source, target = os.path.join(directory, 'primary.db'), os.path.join(directory, 'replica.db')
+            with sqlite3.connect(source) as db:
+                db.execute('CREATE TABLE t (x)')
+                db.execute('INSERT INTO t VALUES (1)')
+            db.close()
+            sync_sqlite_database(source, target)
+            db = sqlite3.connect(target)
+            self.assertEqual(db.execute('SELECT x FROM t').fetchall(), [(1,)])
+            db.close()
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_baseline_roundtrip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            options = {'iterations': 2, 'only': ['audit_log', 'transition_order'], 'baseline': path, 'stdout': StringIO()}
+            call_command('benchmark', save_baseline=True, **options)
+            # the run is rolled back
+            self.assertEqual(Order.objects.count(), 0)
+
+            with open(path) as fh:
+                baseline = json.load(fh)
+            self.assertEqual(baseline['results']['audit_log']['queries_per_op'], 1)
+            baseline['results']['transition_order']['queries_per_op'] = 1
+            with open(path, 'w') as fh:
+                json.dump(baseline, fh)
+
+            with self.assertRaisesMessage(CommandError, 'transition_order'):
+                call_command('benchmark', threshold=1, **options)
+
+    def test_benchmarks_must_define_run(self):
+        class Unfinished(benchmark.Benchmark):
+            name = 'unfinished'
+
+        with self.assertRaises(TypeError):
+            Unfinished(None)
+
+
+class RetryPolicyTest(TestCase):
+    def flaky(self, failures, error='database is locked'):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return len(calls)
+        return fn, calls
+
+    def policy(self, **kwargs):
+        return RetryPolicy(base_delay=0, max_delay=0, **kwargs)
+
+    def call_outside_transaction(self, policy, fn):
+        # TestCase wraps every test in a transaction, where policies never retry
+        with patch.object(connection, 'in_atomic_block', False):
+            return policy.call('test', fn)
+
+    def test_retries_lock_errors_then_succeeds(self):
+        fn, _ = self.flaky(2)
+        token = start_request_retries()
+        self.assertEqual(self.call_outside_transaction(self.policy(), fn), 3)
+        self.assertEqual(finish_request_retries(token), 2)
+
+    def test_other_errors_are_not_retried(self):
+        fn, calls = self.flaky(1, error='no such table: inventory_product')
+        with self.assertRaises(OperationalError):
+            self.call_outside_transaction(self.policy(), fn)
+        self.assertEqual(len(calls), 1)
+
+    def test_attempts_and_budget_are_bounded(self):
+        fn, calls = self.flaky(10)
+        with self.assertRaises(RetriesExhausted) as ctx:
+            self.call_outside_transaction(self.policy(attempts=3), fn)
+        self.assertEqual(len(calls), 3)
+
+        fn, calls = self.flaky(10)
+        budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+        with self.assertRaises(RetriesExhausted) as ctx:
+            self.call_outside_transaction(self.policy(budget=budget), fn)
+        self.assertEqual(ctx.exception.reason, 'retry budget exhausted')
+        self.assertEqual(len(calls), 2)
+
+    def test_no_retry_inside_a_transaction(self):
+        fn, calls = self.flaky(1)
+        with self.assertRaises(OperationalError):
+            self.policy().call('test', fn)
+        self.assertEqual(len(calls), 1)
+
+
+class RetryExhaustedAPITest(APITestCase):
+    def test_reservation_returns_503(self):
+        product = Product.objects.create(name='Busy', total_stock=1, available_stock=1)
+        with patch('inventory.reservation_store.create_reservation', side_effect=RetriesExhausted('create_reservation', 4, 'locked')):
+            response = self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+
+class SoldOutStore(reservation_store.ReservationStore):
+    def __init__(self, **options):
+        self.options = options
+
+    def reserve(self, *, product_id, quantity, actor, warehouses=(), allow_split=False):
+        raise ValidationError('Sold out', code='insufficient_stock')
+
+
+class ReservationStoreTest(APITestCase):
+    def test_backend_comes_from_settings(self):
+        product = Product.objects.create(name='Plugged', total_stock=5, available_stock=5)
+        config = {'BACKEND': 'inventory.tests.SoldOutStore', 'OPTIONS': {'region': 'eu'}}
+        with override_settings(RESERVATION_STORE=config), patch('inventory.reservation_store._store', None):
+            response = self.client.post('/api/reservations/', {'product': product.uuid, 'quantity': 1})
+            self.assertEqual(reservation_store.get_reservation_store().options, {'region': 'eu'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        product.refresh_from_db()
+        self.assertEqual(product.available_stock, 5)
+
+    def test_stores_must_define_reserve(self):
+        with self.assertRaises(TypeError):
+            type('Incomplete', (reservation_store.ReservationStore,), {})()
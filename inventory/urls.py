@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     ProductViewSet,
     ReservationViewSet,
-    OrderViewSet
+    OrderViewSet,
+    StockChangeViewSet,
 )
 
 
@@ -12,6 +13,7 @@ router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='products')
 router.register(r'reservations', ReservationViewSet, basename='reservations')
 router.register(r'orders', OrderViewSet, basename='orders')
+router.register(r'stock-changes', StockChangeViewSet, basename='stock-changes')
 
 urlpatterns = [
     path('', include(router.urls)),
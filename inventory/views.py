@@ -1,21 +1,42 @@
+import uuid
+
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
 from .models import Product, Reservation, Order
 from .serializers import ProductSerializer, ReservationSerializer, OrderSerializer
-from .services import transition_order, audit_log
+from .services import TransitionConflict, transition_order
+from .reservation_store import get_reservation_store
+from .search import search_products
+from .feed import MAX_FEED_LIMIT, ClosingStream, FeedBusy, event_stream, latest_sequence, notifier, wait_for_changes
+from .metrics import RESERVATIONS, RESERVATION_LATENCY
+from core.conditional import ConditionalListMixin
+from core.retry import RetriesExhausted
+from core.fieldsets import SparseFieldsetMixin
 from core.paginator import GlobalPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
-from django.db.models import F
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+
+
+
+MAX_BULK_RELEASE = 500
+
 
+def parse_reservation_ids(values):
+    """Distinct UUIDs in request order, raises ValueError on a malformed id."""
+    return list(dict.fromkeys(uuid.UUID(str(value)) for value in values))
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+def busy_response():
+    # lock contention outlasted the retries: tell the client to come back
+    return Response({'error': 'The system is busy, please retry'}, status=503, headers={'Retry-After': '1'})
+
+
+class ProductViewSet(ConditionalListMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     pagination_class = GlobalPagination
@@ -36,66 +57,127 @@ class ProductViewSet(viewsets.ModelViewSet):
     ]
     ordering = ['-created_at']
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter q is required'}, status=400)
+        try:
+            limit = int(request.query_params.get('limit', 20))
+            products, next_cursor = search_products(query, limit=limit, cursor=request.query_params.get('cursor'))
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=400)
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=400)
+
+        serializer = self.get_serializer(products, many=True)
+        return Response({'next_cursor': next_cursor, 'results': serializer.data})
+
 
 class ReservationViewSet(viewsets.ModelViewSet):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
-    http_method_names = ["post"]
+    http_method_names = ["post", "delete"]
+
+    def get_permissions(self):
+        # a reservation can only be released by the user who made it
+        if self.action in ('destroy', 'release'):
+            return [IsAuthenticated()]
+        return super().get_permissions()
 
     def create(self, request, *args, **kwargs):
+        with RESERVATION_LATENCY.time():
+            response = self._create(request)
+        RESERVATIONS.inc(outcome=getattr(response, 'outcome', 'error'))
+        return response
+
+    def _create(self, request):
         product_id = request.data.get('product')
         try:
             quantity = int(request.data.get('quantity'))
             if quantity <= 0:
-                return Response({'error': 'Quantity must be greater than zero'}, status=400)
+                return self._outcome(Response({'error': 'Quantity must be greater than zero'}, status=400), 'invalid')
         except (TypeError, ValueError):
-            return Response({'error': 'Invalid quantity'}, status=400)
+            return self._outcome(Response({'error': 'Invalid quantity'}, status=400), 'invalid')
+
+        warehouses = request.data.get('warehouses') or []
+        if isinstance(warehouses, str):
+            warehouses = [code.strip() for code in warehouses.split(',') if code.strip()]
+        allow_split = str(request.data.get('allow_split', '')).lower() in ('1', 'true', 'yes')
 
         try:
-            with transaction.atomic():
-                updated = Product.objects.filter(
-                    pk=product_id,
-                    available_stock__gte=quantity
-                ).update(
-                    available_stock=F('available_stock') - quantity,
-                    reserved_stock=F('reserved_stock') + quantity
-                )
-                if not updated:
-                    return Response({'error': 'Not enough stock or product not found'}, status=400)
-
-                product = Product.objects.get(pk=product_id)
-                expires_at = timezone.now() + timedelta(minutes=10)
-                reservation = Reservation.objects.create(
-                    product=product,
-                    quantity=quantity,
-                    expires_at=expires_at
-                )
-                audit_log(
-                    action='reservation_created',
-                    object_type='Reservation',
-                    object_id=str(reservation.pk),
-                    old_value=None,
-                    new_value={
-                        'product': str(product.pk),
-                        'quantity': quantity
-                    },
-                    actor=request.user if request.user.is_authenticated else None,
-                )
-
-        except Product.DoesNotExist:
-            return Response({'error': 'Product not found'}, status=404)
+            reservations = get_reservation_store().reserve(
+                product_id=product_id,
+                quantity=quantity,
+                actor=request.user if request.user.is_authenticated else None,
+                warehouses=warehouses,
+                allow_split=allow_split,
+            )
+        except ValidationError as e:
+            # a malformed product id fails UUID validation with code 'invalid'
+            outcome = e.code if getattr(e, 'code', None) in ('insufficient_stock', 'not_found') else 'invalid'
+            return self._outcome(Response({'error': e.messages[0]}, status=400), outcome)
+        except RetriesExhausted:
+            return self._outcome(busy_response(), 'busy')
         except Exception as e:
-            return Response({'error': 'Something went wrong'}, status=500)
+            return self._outcome(Response({'error': 'Something went wrong'}, status=500), 'error')
 
-        serializer = self.get_serializer(reservation)
-        return Response(serializer.data, status=201)
+        # the shape follows the request, not where the stock happened to be
+        if allow_split:
+            serializer = self.get_serializer(reservations, many=True)
+            return self._outcome(Response({'reservations': serializer.data}, status=201), 'created')
+        serializer = self.get_serializer(reservations[0])
+        return self._outcome(Response(serializer.data, status=201), 'created')
 
+    def destroy(self, request, *args, **kwargs):
+        try:
+            reservation_ids = parse_reservation_ids([kwargs['pk']])
+        except ValueError:
+            return Response({'error': 'Reservation not found or no longer active'}, status=404)
+        try:
+            released = get_reservation_store().release(reservation_ids, actor=request.user)
+        except RetriesExhausted:
+            return busy_response()
+        if not released:
+            return Response({'error': 'Reservation not found or no longer active'}, status=404)
+        return Response(status=204)
 
+    @action(detail=False, methods=['post'])
+    def release(self, request):
+        ids = request.data.get('reservations')
+        if not isinstance(ids, list) or not ids:
+            return Response({'error': 'reservations must be a non-empty list of ids'}, status=400)
+        if len(ids) > MAX_BULK_RELEASE:
+            return Response({'error': f'At most {MAX_BULK_RELEASE} reservations per request'}, status=400)
+        try:
+            reservation_ids = parse_reservation_ids(ids)
+        except ValueError:
+            return Response({'error': 'Invalid reservation id'}, status=400)
 
-class OrderViewSet(viewsets.ModelViewSet):
+        try:
+            released = get_reservation_store().release(reservation_ids, actor=request.user)
+        except RetriesExhausted:
+            return busy_response()
+        released_ids = {reservation.pk for reservation in released}
+        return Response({
+            'released': [str(pk) for pk in reservation_ids if pk in released_ids],
+            'not_released': [str(pk) for pk in reservation_ids if pk not in released_ids],
+        })
+
+    @staticmethod
+    def _outcome(response, outcome):
+        response.outcome = outcome
+        return response
+
+
+
+class OrderViewSet(ConditionalListMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     pagination_class = GlobalPagination
-    queryset = Order.objects.select_related('user').prefetch_related('items__product')
+    # `user` is rendered as a pk (read from user_id), so it needs no join
+    queryset = Order.objects.all()
+    # Product's default ordering would add a pointless sort to the prefetch
+    expandable_fields = {'items': [Prefetch('items__product', queryset=Product.objects.order_by())]}
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = {
         'status': ['exact'],
@@ -113,6 +195,10 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'status': 'confirmed'})
         except ValidationError as e:
             return Response({'error': str(e)}, status=400)
+        except TransitionConflict as e:
+            return Response({'error': str(e), 'status': e.current_status}, status=409)
+        except RetriesExhausted:
+            return busy_response()
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -122,3 +208,66 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'status': 'cancelled'})
         except ValidationError as e:
             return Response({'error': str(e)}, status=400)
+        except TransitionConflict as e:
+            return Response({'error': str(e), 'status': e.current_status}, status=409)
+        except RetriesExhausted:
+            return busy_response()
+
+
+class StockChangeViewSet(viewsets.ViewSet):
+    """
+    Stock change feed. Start with `GET /api/stock-changes/` (no `since`) to
+    get the current sequence, then either long-poll with `?since=N` or
+    subscribe to `stream/` (Server-Sent Events). Waiting clients are capped
+    per process (STOCK_FEED_MAX_WAITERS), the ones over the cap get a 503.
+    """
+
+    def perform_content_negotiation(self, request, force=False):
+        # the event stream is not a DRF rendered response, errors are JSON
+        return super().perform_content_negotiation(request, force=force or self.action == 'stream')
+
+    def _since(self, request):
+        since = request.query_params.get('since') or request.headers.get('Last-Event-ID')
+        if since is None:
+            return None
+        since = int(since)
+        if since < 0:
+            raise ValueError
+        return since
+
+    def list(self, request):
+        try:
+            since = self._since(request)
+            timeout = float(request.query_params.get('timeout', 25))
+            limit = int(request.query_params.get('limit', MAX_FEED_LIMIT))
+        except ValueError:
+            return Response({'error': 'since, timeout and limit must be non-negative numbers'}, status=400)
+
+        if since is None:
+            return Response({'changes': [], 'next': latest_sequence()})
+        try:
+            with notifier.slot():
+                changes, next_seq = wait_for_changes(since, timeout, limit)
+        except FeedBusy:
+            return busy_response()
+        return Response({'changes': changes, 'next': next_seq})
+
+    @action(detail=False, methods=['get'])
+    def stream(self, request):
+        try:
+            since = self._since(request)
+        except ValueError:
+            return Response({'error': 'since must be a non-negative integer'}, status=400)
+        if since is None:
+            since = latest_sequence()
+        try:
+            slot = notifier.slot()
+        except FeedBusy:
+            return busy_response()
+
+        # the slot is held until the response is closed
+        response = StreamingHttpResponse(ClosingStream(event_stream(since), slot), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # don't let nginx buffer the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
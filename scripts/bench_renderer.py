@@ -0,0 +1,96 @@
+import os
+import sys
+import uuid
+import timeit
+from decimal import Decimal
+from datetime import timedelta
+import django
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.utils import timezone
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+from core import renderers
+from core.renderers import RequestIDJSONRenderer
+
+
+class StdlibRequestIDJSONRenderer(JSONRenderer):
+    # the renderer as it was before orjson: stdlib json + in-place request_id
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        request = renderer_context.get("request")
+        if request is not None and hasattr(request, "request_id") and isinstance(data, dict):
+            data["request_id"] = request.request_id
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class FakeRequest:
+    request_id = str(uuid.uuid4())
+
+
+def order_page(size, native):
+    """A paginated order list, either as DRF serializer output (strings) or raw python values."""
+    now = timezone.now()
+    results = []
+    for i in range(size):
+        created_at = now - timedelta(minutes=i)
+        items = [
+            {
+                'product': uuid.uuid4() if native else str(uuid.uuid4()),
+                'product_name': f'Product {i}-{j}',
+                'quantity': j + 1,
+                'price': Decimal('19.99') if native else '19.99',
+            }
+            for j in range(5)
+        ]
+        results.append({
+            'uuid': uuid.uuid4() if native else str(uuid.uuid4()),
+            'user': 1,
+            'status': 'pending',
+            'created_at': created_at if native else created_at.isoformat().replace('+00:00', 'Z'),
+            'total': Decimal('99.95') if native else '99.95',
+            'items': items,
+        })
+    return {
+        'total_items': size * 10,
+        'items_in_this_page': size,
+        'current_page': 1,
+        'total_pages': 10,
+        'has_next': True,
+        'has_previous': False,
+        'results': results,
+    }
+
+
+def bench(renderer, data, number):
+    context = {'request': FakeRequest()}
+    seconds = min(timeit.repeat(lambda: renderer.render(data, 'application/json', context), number=number, repeat=5))
+    return number / seconds
+
+
+def main():
+    if renderers.orjson is None:
+        print("orjson is not installed, RequestIDJSONRenderer uses the stdlib path")
+
+    stdlib = StdlibRequestIDJSONRenderer()
+    fast = RequestIDJSONRenderer()
+
+    print(f"{'payload':<28}{'stdlib ops/s':>14}{'orjson ops/s':>14}{'speedup':>10}{'bytes':>10}{'gzip':>8}")
+    for size in (20, 100):
+        for native in (False, True):
+            data = order_page(size, native)
+            number = max(10, 2000 // size)
+            baseline = bench(stdlib, data, number)
+            candidate = bench(fast, data, number)
+            body = fast.render(data, 'application/json', {'request': FakeRequest()})
+            label = f"{size} orders ({'native' if native else 'serialized'})"
+            print(
+                f"{label:<28}{baseline:>14.0f}{candidate:>14.0f}{candidate / baseline:>9.1f}x"
+                f"{len(body):>10}{len(compress_string(body)):>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
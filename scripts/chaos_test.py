@@ -16,7 +16,7 @@ def attempt_reservation(product_id):
     try:
         response = requests.post(
             f'{BASE_URL}/reservations/',
-            json={'product': int(product_id), 'quantity': 1},
+            json={'product': str(product_id), 'quantity': 1},
             timeout=5
         )
         print(f"Response status: {response.status_code}, text: {response.text}")
@@ -1,10 +1,15 @@
 import os
+import sys
 import django
-from django.utils import timezone
 from datetime import timedelta
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
-django.setup()
+if __name__ == "__main__":
+    # only bootstrap Django when run as a script, importers already have it set up
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    django.setup()
+
+from django.utils import timezone
 
 from inventory.models import Product, Reservation, Order, AuditLog
 from django.contrib.auth.models import User
@@ -55,4 +60,8 @@ def populate_database():
         new_value={'message': 'Sample data created'},
     )
 
-    print("Database populated with sample data!")
\ No newline at end of file
+    print("Database populated with sample data!")
+
+
+if __name__ == "__main__":
+    populate_database()